@@ -0,0 +1,280 @@
+"""
+bench_hot_paths.py - Benchmark suite for the music and harps hot paths
+
+Each benchmark is timed as the best of --repeat runs on synthetic songs of 1k, 100k and 1M notes (where the
+work depends on song length). Results can be saved as a baseline and later runs compared against it, so a
+slowdown shows up as a ratio instead of a user complaint.
+
+Usage (with harp_helper installed):
+    python benchmarks/bench_hot_paths.py                      # run and print
+    python benchmarks/bench_hot_paths.py --save               # run and store benchmarks/baseline.json
+    python benchmarks/bench_hot_paths.py --compare            # run and exit 1 on a regression over --threshold
+                                                              # or on a benchmark missing from the baseline
+    python benchmarks/bench_hot_paths.py --sizes 1000 --filter get_notation
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from harp_helper import engine
+from harp_helper.harps import Harmonica, get_tuning_chart
+from harp_helper import music
+from synthetic import synthetic_lines, synthetic_notation, synthetic_pitches
+
+SIZES = (1_000, 100_000, 1_000_000)
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_THRESHOLD = 1.25
+KEY_SIGNATURE_LOOPS = 10_000
+
+
+# \\\\\\\ Benchmarks: setup(size) returns the function to time ///////
+
+def bench_find_note_indices(size: int):
+    notation = synthetic_notation(size)
+    return lambda: music.find_note_indices(notation)
+
+
+def bench_transpose_half_steps(size: int):
+    expression = music.MusicExpression.from_pitches(synthetic_pitches(size), key="c")
+
+    def run():
+        expression.transpose_half_steps(1)
+        expression.transpose_half_steps(-1)
+    return run
+
+
+def bench_transpose_to_key(size: int):
+    expression = music.MusicExpression.from_pitches(synthetic_pitches(size), key="c")
+
+    def run():
+        expression.transpose_to_key("g")
+        expression.transpose_to_key("c")
+    return run
+
+
+def bench_array_transpose_half_steps(size: int):
+    from harp_helper.music_array import ArrayMusicExpression
+    expression = ArrayMusicExpression.from_pitches(synthetic_pitches(size), key="c")
+
+    def run():
+        expression.transpose_half_steps(1)
+        expression.transpose_half_steps(-1)
+    return run
+
+
+def bench_transposed_views(size: int):
+    # Every transposition within two octaves of one song, as when comparing keys
+    harp = Harmonica("c12", "c")
+    expression = music.MusicExpression.from_pitches(synthetic_pitches(size), key="c")
+    return lambda: [expression.transposed(steps).render(harp.tab_index) for steps in range(-24, 25)]
+
+
+def bench_key_signature(size: int):
+    def run():
+        for _ in range(KEY_SIGNATURE_LOOPS):
+            for key in music.KEYS:
+                music.KeySignature(key)
+    return run
+
+
+def bench_get_notation(size: int):
+    harp = Harmonica("d10s", "c")
+    pitches = synthetic_pitches(size)
+    return lambda: harp.get_notation(pitches)
+
+
+def bench_hole_path(size: int):
+    from harp_helper.optimizer import HolePathOptimizer
+    harp = Harmonica("c12", "c")
+    candidates = music.MusicExpression.from_pitches(synthetic_pitches(size), key="c").render(harp.hole_index)
+    return lambda: HolePathOptimizer().render(candidates)
+
+
+def bench_rank_harps(size: int):
+    from harp_helper import search
+    from harp_helper.tokenizer import Phrase
+    histograms = search.pitch_histograms([Phrase(None, synthetic_pitches(size))])
+    return lambda: search.rank_harps(histograms, transpose_steps=range(-24, 25))
+
+
+def bench_retranscribe_edited_line(size: int):
+    from harp_helper import incremental
+    lines = synthetic_lines(size)
+    cache = incremental.LineCache(max_lines=len(lines) + 1)
+    for _ in cache.transcribe(lines, "d10s"):
+        pass
+    edits = iter(range(1 << 30))
+
+    def run():
+        # A different middle line each run, as when typing
+        lines[len(lines) // 2] = f"c' d' e' # {next(edits)}\n"
+        return [tab_line.phrases for tab_line in cache.transcribe(lines, "d10s")]
+    return run
+
+
+def bench_find_phrase(size: int):
+    import tempfile
+    from harp_helper import melody_index
+    directory = tempfile.TemporaryDirectory()
+    file_name = os.path.join(directory.name, "library.hidx")
+    pitches = synthetic_pitches(size)
+    melody_index.write_index(((f"song{start}", pitches[start:start + 500]) for start in range(0, size, 500)),
+                             file_name)
+    index = melody_index.MelodyIndex(file_name)
+    phrase = pitches[size // 2:size // 2 + 6]
+
+    def run():
+        return index.find(phrase)
+    # The directory (and index) is removed once the benchmark function is released
+    run.directory = directory
+    return run
+
+
+def bench_tuning_chart_csv(size: int):
+    harps = [Harmonica(harmonica_type, "c") for harmonica_type in Harmonica.types()]
+
+    def run():
+        get_tuning_chart.cache_clear()
+        return [harp.tuning_chart(output_format="csv") for harp in harps]
+    return run
+
+
+def bench_tuning_chart_table(size: int):
+    harps = [Harmonica(harmonica_type, "c") for harmonica_type in Harmonica.types()]
+
+    def run():
+        get_tuning_chart.cache_clear()
+        return [harp.tuning_chart(output_format="table") for harp in harps]
+    return run
+
+
+def bench_transposing_charts(size: int):
+    harmonica_types = list(Harmonica.types())
+
+    def run():
+        get_tuning_chart.cache_clear()
+        return [list(engine.generate_transposing_charts(t, "csv")) for t in harmonica_types]
+    return run
+
+
+def bench_transposing_charts_cached(size: int):
+    harmonica_types = list(Harmonica.types())
+    return lambda: [list(engine.generate_transposing_charts(t, "csv")) for t in harmonica_types]
+
+
+# name -> (setup, depends on song size)
+BENCHMARKS = {
+    "find_note_indices": (bench_find_note_indices, True),
+    "transpose_half_steps": (bench_transpose_half_steps, True),
+    "transpose_to_key": (bench_transpose_to_key, True),
+    "array_transpose_half_steps": (bench_array_transpose_half_steps, True),
+    "transposed_views": (bench_transposed_views, True),
+    "key_signature": (bench_key_signature, False),
+    "get_notation": (bench_get_notation, True),
+    "hole_path": (bench_hole_path, True),
+    "rank_harps": (bench_rank_harps, True),
+    "retranscribe_edited_line": (bench_retranscribe_edited_line, True),
+    "find_phrase": (bench_find_phrase, True),
+    "tuning_chart_csv": (bench_tuning_chart_csv, False),
+    "tuning_chart_table": (bench_tuning_chart_table, False),
+    "transposing_charts": (bench_transposing_charts, False),
+    "transposing_charts_cached": (bench_transposing_charts_cached, False)
+}
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmarks(sizes, repeat: int, name_filter: (None, str) = None) -> dict:
+    """Returns {"<benchmark>[<size>]": best seconds}, skipping benchmarks whose optional dependency is missing"""
+    results = {}
+    for name, (setup, sized) in BENCHMARKS.items():
+        if name_filter is not None and name_filter not in name:
+            continue
+        for size in sizes if sized else (None,):
+            label = f"{name}[{size}]" if sized else name
+            try:
+                func = setup(size)
+            except ImportError as e:
+                print(f"{label:40} skipped ({e})")
+                break
+            results[label] = best_time(func, repeat)
+            rate = f"{size / results[label]:>14,.0f} notes/s" if sized else ""
+            print(f"{label:40} {results[label] * 1000:12.3f} ms {rate}")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> tuple[list[str], list[str]]:
+    """Prints the ratio of each result to the baseline, returning the labels slower than threshold and the labels
+    missing from the baseline"""
+    regressions = []
+    missing = []
+    print(f"\n{'benchmark':40} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+    for label, seconds in results.items():
+        if label not in baseline:
+            missing.append(label)
+            print(f"{label:40} {'-':>12} {seconds * 1000:12.3f} {'-':>7}  NO BASELINE")
+            continue
+        ratio = seconds / baseline[label]
+        flag = ""
+        if ratio > threshold:
+            regressions.append(label)
+            flag = "  REGRESSION"
+        print(f"{label:40} {baseline[label] * 1000:12.3f} {seconds * 1000:12.3f} {ratio:7.2f}{flag}")
+    return regressions, missing
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark suite for the music and harps hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="song sizes in notes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filter", default=None, help="only run benchmarks whose name contains FILTER")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline (exit 1 on regression)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"slowdown ratio counted as a regression (default: {DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.repeat, args.filter)
+
+    if args.save:
+        saved = {}
+        if args.filter is not None and os.path.exists(args.baseline):
+            # Only the filtered benchmarks were run: keep the baseline of the others
+            with open(args.baseline, "r") as fh:
+                saved = json.load(fh)["results"]
+        saved.update(results)
+        with open(args.baseline, "w") as fh:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": saved
+            }, fh, indent=2, sort_keys=True)
+            fh.write("\n")
+        print(f"\nsaved baseline to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline, "r") as fh:
+            baseline = json.load(fh)["results"]
+        regressions, missing = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        if missing:
+            print(f"\n{len(missing)} benchmark(s) missing from {args.baseline} (run --save): {', '.join(missing)}")
+        if regressions or missing:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+bench_import.py - Import time of harp_helper modules measured with python -X importtime
+
+Usage (with harp_helper installed): python benchmarks/bench_import.py [--repeat N] [MODULE ...]
+
+Besides the cumulative time, "own" excludes the time spent importing third-party packages (tabulate, numpy,
+PyQt6) so changes to harp_helper itself are not lost in their noise.
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ("harp_helper.music", "harp_helper.harps")
+THIRD_PARTY_PACKAGES = ("tabulate", "numpy", "PyQt6")
+IMPORTTIME_REGEX = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def import_times(module: str) -> dict:
+    """Returns {module name: cumulative microseconds} for one fresh interpreter importing module"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        match = IMPORTTIME_REGEX.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def median_import_time(module: str, repeat: int) -> tuple[float, float]:
+    """Median (cumulative, own) import time of module in milliseconds"""
+    cumulative = []
+    own = []
+    for _ in range(repeat):
+        times = import_times(module)
+        cumulative.append(times[module])
+        own.append(times[module] - sum(times.get(package, 0) for package in THIRD_PARTY_PACKAGES))
+    return statistics.median(cumulative) / 1000, statistics.median(own) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time benchmark")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=15)
+    args = parser.parse_args()
+    for module in args.modules:
+        cumulative, own = median_import_time(module, args.repeat)
+        print(f"{module}: {cumulative:.1f} ms cumulative, {own:.1f} ms own")
+
+
+if __name__ == "__main__":
+    main()
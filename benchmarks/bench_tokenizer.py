@@ -0,0 +1,40 @@
+"""
+bench_tokenizer.py - Tokenizer throughput in notes/second
+
+Usage (with harp_helper installed): python benchmarks/bench_tokenizer.py [--notes N] [--notes-per-line N] [--repeat N]
+"""
+import argparse
+import time
+
+from harp_helper import tokenizer
+from synthetic import synthetic_lines
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenizer throughput benchmark")
+    parser.add_argument("--notes", type=int, default=1_000_000)
+    parser.add_argument("--notes-per-line", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = synthetic_lines(args.notes, args.notes_per_line)
+
+    def run():
+        for _ in tokenizer.tokenize(lines):
+            pass
+
+    seconds = best_time(run, args.repeat)
+    print(f"tokenize: {args.notes:,} notes in {seconds:.3f}s = {args.notes / seconds:,.0f} notes/second")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+check_startup.py - Enforces the command line startup budget using python -X importtime
+
+Fails (exit status 1) if the headless modules import Qt, tabulate or NumPy, or if their median cumulative
+import time exceeds the budget.
+
+Usage (with harp_helper installed): python benchmarks/check_startup.py [--budget MS] [--repeat N]
+"""
+import argparse
+import statistics
+import sys
+
+from bench_import import import_times
+
+HEADLESS_MODULES = ("harp_helper.cli", "harp_helper.engine")
+FORBIDDEN_PACKAGES = ("PyQt6", "tabulate", "numpy")
+DEFAULT_BUDGET_MS = 50.0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Command line startup budget check")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"maximum median import time in milliseconds (default: {DEFAULT_BUDGET_MS})")
+    parser.add_argument("--repeat", type=int, default=9)
+    args = parser.parse_args()
+
+    failed = False
+    for module in HEADLESS_MODULES:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        forbidden = sorted({package for times in runs for package in FORBIDDEN_PACKAGES if package in times})
+        median_ms = statistics.median(times[module] for times in runs) / 1000
+        status = "ok"
+        if forbidden:
+            status = f"FAIL: imports {', '.join(forbidden)}"
+            failed = True
+        elif median_ms > args.budget:
+            status = f"FAIL: over budget of {args.budget:.1f} ms"
+            failed = True
+        print(f"{module}: {median_ms:.1f} ms {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
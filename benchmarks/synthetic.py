@@ -0,0 +1,34 @@
+"""
+synthetic.py - Reproducible synthetic songs for the benchmarks
+"""
+import random
+
+from harp_helper import music
+
+# Notes from c' to c'''' (the range of a standard 10 hole diatonic harmonica in C)
+LOWEST_PITCH = 48
+HIGHEST_PITCH = 84
+
+
+def synthetic_pitches(note_count: int, seed: int = 0) -> list[int]:
+    rng = random.Random(seed)
+    return [rng.randint(LOWEST_PITCH, HIGHEST_PITCH) for _ in range(note_count)]
+
+
+def synthetic_notation(note_count: int, seed: int = 0) -> str:
+    """A single line of random notes"""
+    names = music.CHROMATIC_INDEX['es']
+    return " ".join(names[pitch] for pitch in synthetic_pitches(note_count, seed))
+
+
+def synthetic_lines(note_count: int, notes_per_line: int = 64, seed: int = 0) -> list[str]:
+    """Lines of random notes with a \\key change every 8 lines"""
+    rng = random.Random(seed)
+    names = [music.CHROMATIC_INDEX['es'][pitch] for pitch in range(LOWEST_PITCH, HIGHEST_PITCH + 1)]
+    lines = []
+    for start in range(0, note_count, notes_per_line):
+        notes = " ".join(rng.choice(names) for _ in range(min(notes_per_line, note_count - start)))
+        if len(lines) % 8 == 0:
+            notes = f"\\key {rng.choice(music.KEYS)} \\major {notes}"
+        lines.append(notes + "\n")
+    return lines
@@ -0,0 +1,198 @@
+"""
+batch.py - Multi-core transcription of many music files with a process pool
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+import logging
+import time
+
+from harp_helper import engine
+from harp_helper.harps import Harmonica
+from harp_helper import transcription_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 16
+UNPLAYABLE = "X"
+
+# Per-process state set up by init_worker
+_worker_harp = None
+_worker_options = {}
+_worker_cache = None
+
+
+@dataclass
+class FileResult:
+    file_name: str
+    output_file_name: str
+    phrases: int = 0
+    notes: int = 0
+    unplayable: int = 0
+    seconds: float = 0.0
+    # Whether the tabs came from the transcription cache (None without a cache)
+    cached: (None, bool) = None
+    error: (None, str) = None
+    # Whether the file was not transcribed because a worker process died
+    lost: bool = False
+
+
+@dataclass
+class BatchReport:
+    files: int = 0
+    phrases: int = 0
+    notes: int = 0
+    unplayable: int = 0
+    errors: int = 0
+    lost: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    seconds: float = 0.0
+    failed_files: list[str] = field(default_factory=list)
+    lost_files: list[str] = field(default_factory=list)
+
+    @property
+    def finished(self) -> int:
+        """Files transcribed (or failed with an error) before any worker process died"""
+        return self.files - self.lost
+
+    def add(self, result: FileResult):
+        self.files += 1
+        if result.lost:
+            self.lost += 1
+            self.lost_files.append(result.file_name)
+            return
+        self.phrases += result.phrases
+        self.notes += result.notes
+        self.unplayable += result.unplayable
+        if result.error is not None:
+            self.errors += 1
+            self.failed_files.append(result.file_name)
+        elif result.cached is not None:
+            if result.cached:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def as_dict(self) -> dict:
+        values = asdict(self)
+        values["finished"] = self.finished
+        return values
+
+
+def init_worker(harmonica_type: str, harmonica_key: str, options: dict):
+    """Process pool initializer: builds the harmonica and its indexes (and opens the cache) once per worker"""
+    global _worker_harp, _worker_options, _worker_cache
+    _worker_harp = Harmonica(harmonica_type=harmonica_type, harmonica_key=harmonica_key)
+    _worker_harp.tab_index
+    if options.get("optimize"):
+        _worker_harp.hole_index
+    # The harmonica settings are part of the transcription cache key
+    _worker_options = dict(options, harmonica_type=harmonica_type, harmonica_key=harmonica_key)
+    if options.get("cache_dir") is not None:
+        _worker_cache = transcription_cache.TranscriptionCache(options["cache_dir"], options["cache_size"])
+    else:
+        _worker_cache = None
+
+
+def write_tab_file(phrases, tab_file_name: str, result: FileResult):
+    """Writes each phrase (list of tab notes) of phrases to a tab file, counting them in result"""
+    separator = _worker_options.get("separator", " ")
+    with open(tab_file_name, "w", buffering=engine.WRITE_BUFFER_SIZE) as sink:
+        for tabs in phrases:
+            sink.write(separator.join(tabs))
+            sink.write("\n")
+            result.phrases += 1
+            result.notes += len(tabs)
+            result.unplayable += tabs.count(UNPLAYABLE)
+
+
+def transcribe_file(job: tuple[str, str]) -> FileResult:
+    """Transcribes one (file_name, output_file_name) job with the worker's harmonica
+
+    With a cache, files transcribed before with the same options are copied from it instead, and a new
+    transcription is written to the cache as it is written to the tab file.
+    """
+    file_name, tab_file_name = job
+    result = FileResult(file_name, tab_file_name)
+    start = time.perf_counter()
+    try:
+        cache_key = None
+        entry = None
+        if _worker_cache is not None:
+            state = transcription_cache.file_state(file_name)
+            cache_key = transcription_cache.file_cache_key(file_name, _worker_options)
+            entry = _worker_cache.open_entry(cache_key)
+            result.cached = entry is not None
+        if entry is not None:
+            with entry:
+                write_tab_file(map(transcription_cache.parse_phrase, entry), tab_file_name, result)
+        else:
+            phrases = engine.transcribe(
+                engine.generate_file_phrases(file_name),
+                _worker_harp,
+                source_key=_worker_options.get("source_key"),
+                transpose_steps=_worker_options.get("transpose_steps", 0),
+                direction=_worker_options.get("direction", "closest"),
+                optimize=_worker_options.get("optimize", False))
+            if cache_key is None:
+                write_tab_file(phrases, tab_file_name, result)
+            else:
+                with _worker_cache.writer(cache_key) as writer:
+                    write_tab_file(writer.tee(phrases), tab_file_name, result)
+                    # Stored only if the file did not change while it was hashed and transcribed
+                    if transcription_cache.file_state(file_name) == state:
+                        writer.commit()
+    except (OSError, ValueError, NotImplementedError) as e:
+        result.error = str(e)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def run_batch(file_names,
+              output_dir: str,
+              harmonica_type: str,
+              harmonica_key: str = "c",
+              source_key: (None, str) = None,
+              transpose_steps: int = 0,
+              direction: str = "closest",
+              optimize: bool = False,
+              separator: str = " ",
+              workers: (None, int) = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE,
+              cache_dir: (None, str) = None,
+              cache_size: int = transcription_cache.DEFAULT_MAX_BYTES):
+    """Generator for yielding a FileResult for each file (in input order), transcribed across worker processes
+
+    Each file is written to output_dir/<name>.tab: files with the same name raise ValueError before any is
+    transcribed. If a worker process dies, the files not yet yielded are yielded as lost. workers defaults to
+    the number of CPUs. With a cache_dir, the workers share a TranscriptionCache of up to cache_size bytes there.
+    """
+    options = {
+        "source_key": source_key,
+        "transpose_steps": transpose_steps,
+        "direction": direction,
+        "optimize": optimize,
+        "separator": separator,
+        "cache_dir": cache_dir,
+        "cache_size": cache_size
+    }
+    # Fail fast on an unknown harmonica type or key rather than in every worker
+    Harmonica(harmonica_type=harmonica_type, harmonica_key=harmonica_key)
+    if cache_dir is not None:
+        transcription_cache.TranscriptionCache(cache_dir, cache_size)
+
+    jobs = engine.tab_file_jobs(file_names, output_dir)
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(harmonica_type, harmonica_key, options)) as executor:
+        done = 0
+        try:
+            for result in executor.map(transcribe_file, jobs, chunksize=chunk_size):
+                yield result
+                done += 1
+        except BrokenProcessPool as e:
+            # A worker died (killed, out of memory...): the pool cancels every file not yet returned
+            logger.debug(f"batch: worker process died, {len(jobs) - done} files lost: {e}")
+            for file_name, tab_file_name in jobs[done:]:
+                yield FileResult(file_name, tab_file_name, error=f"lost: {e}", lost=True)
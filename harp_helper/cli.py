@@ -0,0 +1,446 @@
+"""
+cli.py - Command line entry point ("harp")
+
+Running "harp" with no sub-command starts the graphical application. The "tab" sub-command
+transcribes music files to harmonica tablature without loading Qt, "keys" ranks the harmonicas a song
+fits best, "index" and "find" search a library of songs for a phrase in any key and "serve" answers
+transcription requests over HTTP.
+"""
+import argparse
+import logging
+import sys
+
+from harp_helper import constants
+
+logger = logging.getLogger('harp')
+
+
+def add_transcription_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("-t", "--type", dest="harmonica_type", default="d10s",
+                        help="harmonica type (default: d10s)")
+    parser.add_argument("-k", "--key", dest="harmonica_key", default="c",
+                        help="harmonica key in notation format (default: c)")
+    parser.add_argument("-s", "--source-key", default=None,
+                        help="key of the source music (default: the harmonica key)")
+    parser.add_argument("-n", "--transpose", dest="transpose_steps", type=int, default=0,
+                        help="half-steps to transpose the source music")
+    parser.add_argument("-d", "--direction", default="closest", choices=("closest", "up", "down"),
+                        help="direction to transpose between keys (default: closest)")
+    parser.add_argument("-b", "--best-holes", dest="optimize", action="store_true",
+                        help="choose one hole for notes playable on several holes (least movement and "
+                             "blow/draw or slide changes)")
+    parser.add_argument("--separator", default=" ",
+                        help="separator placed between tab notes (default: space)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="harp", description=constants.FULL_RELEASE_NAME)
+    parser.add_argument("--debug", action="store_true", help="enable debug logging")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("gui", help="start the graphical application (default)")
+
+    tab_parser = subparsers.add_parser("tab", help="transcribe music files to harmonica tablature")
+    tab_parser.add_argument("files", nargs="*", metavar="FILE",
+                            help="music notation files to transcribe ('-' for stdin)")
+    tab_parser.add_argument("-e", "--expression", action="append", default=[],
+                            help="music expression to transcribe (may be repeated)")
+    add_transcription_arguments(tab_parser)
+    tab_parser.add_argument("-o", "--output-dir", default=None,
+                            help="write each FILE to OUTPUT_DIR/<name>.tab instead of stdout")
+    tab_parser.add_argument("--timings", default=None, metavar="JSON_FILE",
+                            help="record per-stage timings and dump them as JSON to JSON_FILE ('-' for stderr)")
+
+    batch_parser = subparsers.add_parser("batch", help="transcribe many music files in parallel")
+    batch_parser.add_argument("files", nargs="*", metavar="FILE", help="music notation files to transcribe")
+    batch_parser.add_argument("-f", "--file-list", default=None,
+                              help="file containing music file names, one per line ('-' for stdin)")
+    batch_parser.add_argument("-o", "--output-dir", required=True,
+                              help="write each FILE to OUTPUT_DIR/<name>.tab")
+    add_transcription_arguments(batch_parser)
+    batch_parser.add_argument("-j", "--jobs", type=int, default=None,
+                              help="number of worker processes (default: number of CPUs)")
+    batch_parser.add_argument("--chunk-size", type=int, default=16,
+                              help="files sent to a worker at a time (default: 16)")
+    batch_parser.add_argument("--report", default=None,
+                              help="write the per-file results and aggregate report to REPORT as JSON")
+    batch_parser.add_argument("--cache-dir", default=None,
+                              help="reuse the tabs of files transcribed before with the same options from a "
+                                   "transcription cache in CACHE_DIR")
+    batch_parser.add_argument("--cache-size", type=int, default=256, metavar="MB",
+                              help="most megabytes kept in the cache, least recently used removed first "
+                                   "(default: 256)")
+
+    chart_parser = subparsers.add_parser("chart", help="write tuning or transposing charts")
+    chart_parser.add_argument("-t", "--type", dest="harmonica_type", default="d10s",
+                              help="harmonica type (default: d10s)")
+    chart_parser.add_argument("-k", "--key", dest="harmonica_key", default=None,
+                              help="write the tuning chart of a harmonica in KEY (default: transposing charts "
+                                   "for every key)")
+    chart_parser.add_argument("-f", "--format", dest="output_format", default="table",
+                              help="table, csv, jsonl or html (default: table)")
+    chart_parser.add_argument("--notation", action="store_true",
+                              help="spell notes in notation format instead of music symbols")
+    chart_parser.add_argument("-o", "--output", default=None, help="write to OUTPUT instead of stdout")
+
+    convert_parser = subparsers.add_parser("convert", help="convert music files to binary song files and back")
+    convert_parser.add_argument("files", nargs="+", metavar="FILE",
+                                help="music notation files (written as song files) or song files (written as "
+                                     "notation)")
+    convert_parser.add_argument("-o", "--output-dir", default=None,
+                                help="write the converted files to OUTPUT_DIR (default: next to each FILE)")
+    convert_parser.add_argument("--force", action="store_true", help="overwrite converted files that already exist")
+
+    keys_parser = subparsers.add_parser("keys", help="rank harmonica types, keys and transpositions for a song")
+    keys_parser.add_argument("files", nargs="*", metavar="FILE",
+                             help="music notation files making up the song ('-' for stdin)")
+    keys_parser.add_argument("-e", "--expression", action="append", default=[],
+                             help="music expression to include (may be repeated)")
+    keys_parser.add_argument("-t", "--type", dest="harmonica_types", action="append", default=None,
+                             help="harmonica type to consider (may be repeated, default: all)")
+    keys_parser.add_argument("-a", "--all-steps", action="store_true",
+                             help="try every transposition up to two octaves (default: octaves only)")
+    keys_parser.add_argument("-d", "--direction", default="closest", choices=("closest", "up", "down"),
+                             help="direction to transpose between keys (default: closest)")
+    keys_parser.add_argument("--top", type=int, default=10, help="number of results to show (default: 10)")
+
+    index_parser = subparsers.add_parser("index", help="index a library of songs for phrase searches")
+    index_parser.add_argument("files", nargs="*", metavar="FILE", help="music notation or song files to index")
+    index_parser.add_argument("-f", "--file-list", default=None,
+                              help="file containing music file names, one per line ('-' for stdin)")
+    index_parser.add_argument("-o", "--output", required=True, help="index file to write (e.g. library.hidx)")
+
+    find_parser = subparsers.add_parser("find", help="find the songs containing a phrase in any key")
+    find_parser.add_argument("index", metavar="INDEX", help="index file written by \"harp index\"")
+    find_parser.add_argument("phrase", metavar="PHRASE", help="notes of the phrase, e.g. \"c' d' e' g'\"")
+    find_parser.add_argument("-t", "--type", dest="harmonica_types", action="append", default=None,
+                             help="harmonica type to list playable keys for (may be repeated, default: all)")
+    find_parser.add_argument("--top", type=int, default=None, help="number of matches to show (default: all)")
+    find_parser.add_argument("--json", action="store_true", help="write the matches as JSON Lines")
+
+    serve_parser = subparsers.add_parser("serve", help="serve transcriptions over local HTTP/JSON")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    serve_parser.add_argument("-p", "--port", type=int, default=8765, help="port to listen on (default: 8765)")
+    serve_parser.add_argument("--batch-window", type=float, default=2.0, metavar="MS",
+                              help="milliseconds to wait for concurrent requests to batch together (default: 2)")
+    serve_parser.add_argument("--max-batch", type=int, default=64,
+                              help="most requests transcribed in one batch (default: 64)")
+    return parser
+
+
+def write_tabs(phrases, out, args):
+    """Transcribes phrases and writes each one to out"""
+    from harp_helper import engine
+
+    engine.write_phrases(
+        phrases,
+        out,
+        harmonica_type=args.harmonica_type,
+        harmonica_key=args.harmonica_key,
+        source_key=args.source_key,
+        transpose_steps=args.transpose_steps,
+        direction=args.direction,
+        optimize=args.optimize,
+        separator=args.separator
+    )
+
+
+def dump_timings(file_name: str):
+    from harp_helper import instrument
+
+    if file_name == "-":
+        print(instrument.dumps(), file=sys.stderr)
+    else:
+        with open(file_name, "w") as fh:
+            fh.write(instrument.dumps())
+            fh.write("\n")
+
+
+def tab_command(args) -> int:
+    from harp_helper import engine
+    from harp_helper import instrument
+
+    if args.timings is not None:
+        instrument.enable()
+
+    if not args.files and not args.expression:
+        args.files = ["-"]
+
+    output_file_names = {}
+    if args.output_dir is not None:
+        try:
+            output_file_names = dict(engine.tab_file_jobs(
+                (file_name for file_name in args.files if file_name != "-"), args.output_dir))
+        except ValueError as e:
+            print(f"harp: error: {e}", file=sys.stderr)
+            return 1
+
+    errors = 0
+    for expression in args.expression:
+        try:
+            write_tabs(engine.generate_phrases([expression]), sys.stdout, args)
+        except (ValueError, NotImplementedError) as e:
+            print(f"harp: error: expression '{expression}': {e}", file=sys.stderr)
+            errors += 1
+
+    for file_name in args.files:
+        try:
+            if file_name == "-":
+                write_tabs(engine.generate_phrases(sys.stdin), sys.stdout, args)
+                continue
+            phrases = engine.generate_file_phrases(file_name)
+            if args.output_dir is None:
+                write_tabs(phrases, sys.stdout, args)
+            else:
+                with open(output_file_names[file_name], "w", buffering=engine.WRITE_BUFFER_SIZE) as out:
+                    write_tabs(phrases, out, args)
+        except (OSError, ValueError, NotImplementedError) as e:
+            print(f"harp: error: {file_name}: {e}", file=sys.stderr)
+            errors += 1
+
+    logger.debug(f"harmonica layout caches: {engine.Harmonica.cache_info()}")
+    if args.timings is not None:
+        dump_timings(args.timings)
+    return 1 if errors else 0
+
+
+def write_charts(out, args):
+    """Writes the charts selected by args to out"""
+    from harp_helper import engine
+
+    engine.write_charts(
+        out,
+        harmonica_type=args.harmonica_type,
+        output_format=args.output_format,
+        harmonica_key=args.harmonica_key,
+        use_music_symbols=not args.notation
+    )
+
+
+def chart_command(args) -> int:
+    from harp_helper import engine
+
+    try:
+        if args.output is None:
+            write_charts(sys.stdout, args)
+        else:
+            with open(args.output, "w", buffering=engine.WRITE_BUFFER_SIZE) as out:
+                write_charts(out, args)
+    except (OSError, ValueError, NotImplementedError) as e:
+        print(f"harp: error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def convert_command(args) -> int:
+    import os
+    from harp_helper import engine
+    from harp_helper import songfile
+
+    errors = 0
+    for file_name in args.files:
+        output_dir = args.output_dir if args.output_dir is not None else os.path.dirname(file_name)
+        base_name = os.path.splitext(os.path.basename(file_name))[0]
+        try:
+            to_notation = songfile.is_song_file(file_name)
+            if to_notation:
+                output_file_name = os.path.join(output_dir, base_name + songfile.NOTATION_FILE_EXTENSION)
+            else:
+                output_file_name = os.path.join(output_dir, base_name + songfile.SONG_FILE_EXTENSION)
+            # Converting a song file next to its source would otherwise replace the source
+            if not args.force and os.path.exists(output_file_name):
+                raise ValueError(f"{output_file_name} already exists (use -o or --force)")
+            if to_notation:
+                with open(output_file_name, "w", buffering=engine.WRITE_BUFFER_SIZE) as out:
+                    out.writelines(songfile.generate_notation_lines(songfile.generate_song_phrases(file_name)))
+            else:
+                phrase_count, pitch_count = songfile.write_song(engine.generate_file_phrases(file_name),
+                                                                output_file_name)
+                logger.debug(f"{file_name}: {phrase_count} phrases, {pitch_count} notes")
+            print(f"{file_name} -> {output_file_name}")
+        except (OSError, ValueError) as e:
+            print(f"harp: error: {file_name}: {e}", file=sys.stderr)
+            errors += 1
+    return 1 if errors else 0
+
+
+def keys_command(args) -> int:
+    from harp_helper import engine
+    from harp_helper import search
+
+    if not args.files and not args.expression:
+        args.files = ["-"]
+
+    def generate_song_phrases():
+        yield from engine.generate_phrases(args.expression)
+        for file_name in args.files:
+            if file_name == "-":
+                yield from engine.generate_phrases(sys.stdin)
+            else:
+                yield from engine.generate_file_phrases(file_name)
+
+    try:
+        histograms = search.pitch_histograms(generate_song_phrases())
+        scores = search.rank_harps(
+            histograms,
+            harmonica_types=args.harmonica_types,
+            transpose_steps=range(-24, 25) if args.all_steps else search.OCTAVE_STEPS,
+            direction=args.direction
+        )
+    except (OSError, ValueError, NotImplementedError) as e:
+        print(f"harp: error: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{'type':8} {'key':5} {'steps':>5} {'unplayable':>10} {'out of range':>12}")
+    for score in scores[:args.top]:
+        print(f"{score.harmonica_type:8} {score.harmonica_key:5} {score.transpose_steps:>5} "
+              f"{score.unplayable:>10} {score.out_of_range:>12}")
+    return 0
+
+
+def generate_batch_file_names(args):
+    yield from args.files
+    if args.file_list is not None:
+        fh = sys.stdin if args.file_list == "-" else open(args.file_list, "r")
+        with fh:
+            for line in fh:
+                if line.strip():
+                    yield line.strip()
+
+
+def batch_command(args) -> int:
+    import json
+    import time
+    from harp_helper import batch
+
+    report = batch.BatchReport()
+    results = []
+    start = time.perf_counter()
+    try:
+        for result in batch.run_batch(
+                generate_batch_file_names(args),
+                args.output_dir,
+                harmonica_type=args.harmonica_type,
+                harmonica_key=args.harmonica_key,
+                source_key=args.source_key,
+                transpose_steps=args.transpose_steps,
+                direction=args.direction,
+                optimize=args.optimize,
+                separator=args.separator,
+                workers=args.jobs,
+                chunk_size=args.chunk_size,
+                cache_dir=args.cache_dir,
+                cache_size=args.cache_size << 20):
+            report.add(result)
+            # Lost files are listed in the summary after the loop
+            if result.error is not None and not result.lost:
+                print(f"harp: error: {result.file_name}: {result.error}", file=sys.stderr)
+            elif not result.lost:
+                cached = " (cached)" if result.cached else ""
+                print(f"{result.file_name}: {result.notes} notes, {result.unplayable} unplayable{cached}")
+            if args.report is not None:
+                results.append(result)
+    except (OSError, ValueError, NotImplementedError) as e:
+        print(f"harp: error: {e}", file=sys.stderr)
+        return 1
+    report.seconds = time.perf_counter() - start
+
+    print(f"{report.files} files, {report.notes} notes, {report.unplayable} unplayable, "
+          f"{report.errors} errors in {report.seconds:.2f}s", file=sys.stderr)
+    if report.lost:
+        print(f"harp: error: a worker process died: {report.finished} files finished, {report.lost} lost:",
+              file=sys.stderr)
+        for file_name in report.lost_files:
+            print(f"  {file_name}", file=sys.stderr)
+    if args.cache_dir is not None:
+        print(f"transcription cache: {report.cache_hits} hits, {report.cache_misses} misses", file=sys.stderr)
+    if args.report is not None:
+        with open(args.report, "w") as fh:
+            json.dump({"report": report.as_dict(), "files": [vars(r) for r in results]}, fh, indent=2)
+    return 1 if report.errors or report.lost else 0
+
+
+def index_command(args) -> int:
+    from harp_helper import engine
+    from harp_helper import melody_index
+
+    errors = 0
+
+    def generate_songs():
+        nonlocal errors
+        for file_name in generate_batch_file_names(args):
+            try:
+                yield file_name, melody_index.song_pitches(engine.generate_file_phrases(file_name))
+            except (OSError, ValueError) as e:
+                print(f"harp: error: {file_name}: {e}", file=sys.stderr)
+                errors += 1
+
+    try:
+        song_count, note_count = melody_index.write_index(generate_songs(), args.output)
+    except (OSError, ValueError) as e:
+        print(f"harp: error: {e}", file=sys.stderr)
+        return 1
+    print(f"{song_count} songs, {note_count} notes -> {args.output}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+def find_command(args) -> int:
+    import json
+    from harp_helper import melody_index
+
+    try:
+        with melody_index.MelodyIndex(args.index) as index:
+            matches = index.find(args.phrase, harmonica_types=args.harmonica_types, limit=args.top)
+    except (OSError, ValueError, NotImplementedError) as e:
+        print(f"harp: error: {e}", file=sys.stderr)
+        return 1
+
+    for match in matches:
+        if args.json:
+            print(json.dumps(match.as_dict()))
+            continue
+        playable = "; ".join(f"{harmonica_type}: {' '.join(keys) or '-'}"
+                             for harmonica_type, keys in match.playable.items())
+        print(f"{match.song}:{match.offset} {match.transpose_steps:+d} [{match.notation}] {playable}")
+    return 0
+
+
+def serve_command(args) -> int:
+    from harp_helper import server
+
+    try:
+        server.serve(args.host, args.port, batch_window=args.batch_window / 1000, max_batch=args.max_batch)
+    except (OSError, ValueError) as e:
+        print(f"harp: error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def gui_command(args) -> int:
+    from harp_helper.main import main as gui_main
+    gui_main()
+    return 0
+
+
+COMMANDS = {
+    None: gui_command,
+    "gui": gui_command,
+    "tab": tab_command,
+    "batch": batch_command,
+    "chart": chart_command,
+    "convert": convert_command,
+    "keys": keys_command,
+    "index": index_command,
+    "find": find_command,
+    "serve": serve_command
+}
+
+
+def main(argv: (None, list[str]) = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    return COMMANDS[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+engine.py - Qt-free transcription pipeline shared by the GUI and the command line
+"""
+import logging
+import os
+import time
+
+from harp_helper.harps import Harmonica, get_tuning_chart, tuning_chart_rows
+from harp_helper import instrument
+from harp_helper import music
+from harp_helper.optimizer import HolePathOptimizer
+from harp_helper import tokenizer
+
+logger = logging.getLogger(__name__)
+
+# Buffer sizes used when streaming music files in and transcriptions out
+READ_BUFFER_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
+TAB_FILE_EXTENSION = ".tab"
+
+
+def tab_file_name(file_name: str, output_dir: str) -> str:
+    """Returns output_dir/<name>.tab for a music file"""
+    base_name = os.path.splitext(os.path.basename(file_name))[0]
+    return os.path.join(output_dir, base_name + TAB_FILE_EXTENSION)
+
+
+def tab_file_jobs(file_names, output_dir: str) -> list[tuple[str, str]]:
+    """Returns (file name, tab file name) for each music file
+
+    Raises ValueError if two files would be written to the same tab file (e.g. a/song.ly and b/song.ly), before
+    anything is written.
+    """
+    jobs = []
+    sources = {}
+    for file_name in file_names:
+        output_file_name = tab_file_name(file_name, output_dir)
+        key = os.path.normcase(os.path.abspath(output_file_name))
+        if key in sources:
+            raise ValueError(f"{sources[key]} and {file_name} would both be written to {output_file_name}")
+        sources[key] = file_name
+        jobs.append((file_name, output_file_name))
+    return jobs
+
+
+def generate_file_lines(file_name: str, encoding: str = "utf-8"):
+    """Generator for yielding each line of a file, read in large buffered chunks
+
+    Only one chunk is held at a time so memory use does not grow with the size of the file.
+    """
+    with open(file_name, "r", encoding=encoding, buffering=READ_BUFFER_SIZE) as fh:
+        yield from fh
+
+
+def generate_phrases(lines):
+    """Generator for yielding tokenizer.Phrase objects from lines of notation (timed when instrumented)"""
+    if instrument.enabled:
+        return instrument.timed(tokenizer.tokenize(instrument.timed(lines, "read")), "tokenize")
+    return tokenizer.tokenize(lines)
+
+
+def generate_file_phrases(file_name: str):
+    """Generator for yielding tokenizer.Phrase objects from a music file or a binary song file (see songfile)
+
+    Song files are read through a memory map and skip parsing entirely.
+    """
+    from harp_helper import songfile
+
+    if songfile.is_song_file(file_name):
+        return songfile.generate_song_phrases(file_name)
+    return generate_phrases(generate_file_lines(file_name))
+
+
+def transcribe(phrases,
+               harp: Harmonica,
+               source_key: (None, str) = None,
+               transpose_steps: int = 0,
+               direction: str = "closest",
+               optimize: bool = False):
+    """Generator for yielding a list of tab notation for each tokenizer.Phrase
+
+    With optimize, one hole is chosen for each note that can be played on several holes (see
+    optimizer.HolePathOptimizer) instead of listing them all.
+    """
+
+    if source_key is None:
+        source_key = harp.key
+    logger.debug(f"initial source key is {source_key}")
+    hole_optimizer = HolePathOptimizer() if optimize else None
+    timing = instrument.enabled
+    start = 0.0
+    for phrase in phrases:
+        if timing:
+            start = time.perf_counter()
+
+        if phrase.key is not None:
+            source_key = phrase.key
+            logger.debug(f"setting source key to {source_key}")
+
+        expression = music.expression_class(len(phrase.pitches)).from_pitches(phrase.pitches, key=source_key)
+        if timing:
+            start = instrument.lap("key", start)
+
+        # Transposing a view only moves its offset (range checked once); the notes are shifted while rendering
+        if transpose_steps != 0:
+            logger.debug(f"transposing half-steps={transpose_steps}")
+        view = expression.transposed(transpose_steps)
+
+        if source_key != harp.key:
+            logger.debug(f"transposing from key {expression.key}"
+                         f" to key {harp.key}"
+                         f" direction: {direction}")
+            view = view.transpose_to_key(key=harp.key, direction=direction)
+        if timing:
+            start = instrument.lap("transpose", start)
+
+        if hole_optimizer is None:
+            tabs = view.render(harp.tab_index)
+        else:
+            tabs = hole_optimizer.render(view.render(harp.hole_index))
+        if timing:
+            instrument.lap("tab", start)
+        yield tabs
+
+
+def transcribe_lines(lines,
+                     harmonica_type: str,
+                     harmonica_key: str = "c",
+                     source_key: (None, str) = None,
+                     transpose_steps: int = 0,
+                     direction: str = "closest",
+                     optimize: bool = False):
+    """Generator for yielding a list of tab notation for each phrase in lines of notation"""
+    harp = Harmonica(harmonica_type=harmonica_type, harmonica_key=harmonica_key)
+    yield from transcribe(
+        generate_phrases(lines),
+        harp,
+        source_key=source_key,
+        transpose_steps=transpose_steps,
+        direction=direction,
+        optimize=optimize
+    )
+
+
+def write_phrases(phrases,
+                  sink,
+                  harmonica_type: str,
+                  harmonica_key: str = "c",
+                  source_key: (None, str) = None,
+                  transpose_steps: int = 0,
+                  direction: str = "closest",
+                  optimize: bool = False,
+                  separator: str = " ",
+                  line_end: str = "\n") -> int:
+    """Transcribes tokenizer.Phrase objects, writing each phrase to sink (any object with write()) as it is
+    produced
+
+    Returns the number of phrases written.
+    """
+    timing = instrument.enabled
+    count = 0
+    for tabs in transcribe(
+            phrases,
+            Harmonica(harmonica_type=harmonica_type, harmonica_key=harmonica_key),
+            source_key=source_key,
+            transpose_steps=transpose_steps,
+            direction=direction,
+            optimize=optimize):
+        if timing:
+            start = time.perf_counter()
+        sink.write(separator.join(tabs))
+        sink.write(line_end)
+        if timing:
+            instrument.lap("render", start)
+        count += 1
+    return count
+
+
+def write_transcription(lines, sink, **kwargs) -> int:
+    """Transcribes lines of notation to sink; keyword arguments are passed to write_phrases"""
+    return write_phrases(generate_phrases(lines), sink, **kwargs)
+
+
+def transcribe_file(file_name: str, output_file_name: str, **kwargs) -> int:
+    """Streams a music (or song) file to a tab file; keyword arguments are passed to write_phrases"""
+    with open(output_file_name, "w", buffering=WRITE_BUFFER_SIZE) as sink:
+        return write_phrases(generate_file_phrases(file_name), sink, **kwargs)
+
+
+def transposing_chart_title(key: str) -> str:
+    return f"Source music: {music.KeySignature(key).name}"
+
+
+def generate_transposing_charts(harmonica_type: str, output_format: str, keys=music.KEYS):
+    """Generator for yielding a tuning chart (with a title line) for each source key
+
+    Charts come from the shared harps.get_tuning_chart cache, so no Harmonica is built per key and repeat
+    requests are lookups.
+    """
+    for key in keys:
+        yield get_tuning_chart(harmonica_type, key, output_format, title=transposing_chart_title(key)) + "\n"
+
+
+def write_charts(sink,
+                 harmonica_type: str,
+                 output_format: str,
+                 keys=music.KEYS,
+                 harmonica_key: (None, str) = None,
+                 use_music_symbols: bool = True):
+    """Streams charts to sink (any object with write()) with the writer for output_format
+
+    Writes the tuning chart of harmonica_key, or else a transposing chart (with a title) for each of keys.
+    Returns the number of charts written.
+    """
+    from harp_helper import writers
+    with writers.get_writer(output_format, sink) as writer:
+        if harmonica_key is not None:
+            writer.write_table(*tuning_chart_rows(harmonica_type, harmonica_key, use_music_symbols))
+        else:
+            for key in keys:
+                headers, rows = tuning_chart_rows(harmonica_type, key, use_music_symbols)
+                writer.write_table(headers, rows, title=transposing_chart_title(key))
+        return writer.tables
@@ -1,31 +1,63 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from functools import lru_cache
 from importlib import import_module
+import io
 import logging
-import pkgutil
-from tabulate import tabulate
+from types import MappingProxyType
 
 from harp_helper import music
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of (harmonica_type, key) layouts held in the class-level caches
+LAYOUT_CACHE_SIZE = 128
+# Maximum number of rendered tuning charts held (one per type, key, format, symbols and transposition)
+CHART_CACHE_SIZE = 256
+
+# Entry point group for third-party harmonica definitions. The entry point name is the harmonica_type, e.g.
+#   entry_points={'harp_helper.harmonicas': ['b16=my_harps.bass:Bass16']}
+ENTRY_POINT_GROUP = "harp_helper.harmonicas"
+
+
+@dataclass(frozen=True)
+class Hole:
+    """One way of playing a pitch: the (1 based) hole number and the action, e.g. "draw <" is breath "draw" with
+    slide "<" """
+    number: int
+    action: str
+    breath: str
+    slide: str
+    notation: str
+
 
 class Harmonica(ABC):
 
     harmonica_type = None
     harmonica_description = "Harmonica"
-    keys_available = ("fis", "f", "e", "ees", "d" "des", "c", "b", "bes", "a", "aes", "g")
+    keys_available = ("fis", "f", "e", "ees", "d", "des", "c", "b", "bes", "a", "aes", "g")
     action_notation = {}
 
+    # harmonica_type -> Harmonica subclass, filled as subclasses are defined
+    _registry = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.harmonica_type is not None:
+            cls._registry[cls.harmonica_type.lower()] = cls
+
     def __init__(self, harmonica_type: str, harmonica_key: str = "c"):
         self._key = music.KeySignature(harmonica_key)
         if len(self.action_notation) < 1:
             raise RuntimeError(f"SCRIPT ERROR: action_notation not defined in class {self.get_class_name()}")
 
-    def __new__(cls, harmonica_type: str, harmonica_key: str):
-        for subclass in cls.__subclasses__():
-            if subclass.harmonica_type == harmonica_type.lower():
-                return super(Harmonica, subclass).__new__(subclass)
-        raise NotImplementedError(f"Harmonica type {harmonica_type}")
+    def __new__(cls, harmonica_type: str, harmonica_key: str = "c"):
+        # Harmonica(type, key) builds the registered subclass; a subclass only builds its own type
+        if cls is Harmonica:
+            return super().__new__(get_harmonica_class(harmonica_type))
+        if cls.harmonica_type is None or harmonica_type.lower() != cls.harmonica_type.lower():
+            raise TypeError(f"{cls.get_class_name()} is not a harmonica of type {harmonica_type}")
+        return super().__new__(cls)
 
     @classmethod
     def get_class_name(cls):
@@ -41,14 +73,25 @@ class Harmonica(ABC):
     def highest_note(self):
         pass
 
-    @property
     @abstractmethod
-    def tuning_values(self):
+    def build_tuning_values(self) -> dict:
+        """Returns a dict of action -> list of notes (one per hole) for the harmonica key"""
         pass
 
+    @property
+    def tuning_values(self) -> MappingProxyType:
+        """Immutable mapping of action -> tuple of notes (computed once per type and key)"""
+        return get_tuning_layout(self.harmonica_type, self.key)[0]
+
+    @property
+    def tuning_pitches(self) -> MappingProxyType:
+        """Immutable mapping of action -> tuple of chromatic pitches (computed once per type and key)"""
+        return get_tuning_layout(self.harmonica_type, self.key)[1]
+
     @classmethod
     def types(cls):
-        return {subclass.harmonica_type: subclass.harmonica_description for subclass in cls.__subclasses__()}
+        discover_harmonicas()
+        return {harmonica_type: subclass.harmonica_description for harmonica_type, subclass in cls._registry.items()}
 
     @property
     def key(self):
@@ -85,55 +128,207 @@ class Harmonica(ABC):
                      output_format: str = "table",
                      transpose_steps: int = 0,
                      transpose_key: (None, str) = None):
-        """Creates a tuning chart or transposing chart"""
-
-        details = []
-        for label, chart_notes in self.tuning_values.items():
-
-            # Process through MusicExpression to handle transposing
-            expression = music.MusicExpression(" ".join(chart_notes), key=self._key.notation)
-            if transpose_key is not None:
-                expression.transpose_to_key(transpose_key)
-            if transpose_steps != 0:
-                expression.transpose_half_steps(transpose_steps)
-
-            if use_music_symbols:
-                details.append([label] + [music.NoteParser(n).musical_name for n in expression.scale_notation_list])
-            else:
-                details.append([label] + expression.scale_notation_list)
-
-        headers = list(range(1, max([len(line) for line in details])))
-        headers.insert(0, "")
-
-        if output_format == "table":
-            return tabulate(details, headers=headers, tablefmt="pretty")
-        elif output_format == "csv":
-            csv_lines = [",".join([str(h) for h in headers])]
-            for detail in details:
-                csv_lines.append(",".join(detail))
-            return "\n".join(csv_lines)
-        else:
-            raise ValueError(f"Unknown output format {output_format}")
-
-    def get_notation(self, notes: list[str]):
-        """"Accepts a list of strings (each note) and outputs list of strings in harmonica tablature """
-
-        holes_by_pitches = {}
-        for action, tuning_values in self.tuning_values.items():
+        """Creates a tuning chart or transposing chart (cached, see get_tuning_chart)"""
+        return get_tuning_chart(self.harmonica_type, self.key, output_format, use_music_symbols,
+                                transpose_steps, transpose_key)
+
+    @classmethod
+    def cache_info(cls) -> dict:
+        """Hit/miss statistics of the class-level layout caches"""
+        return {
+            "tuning_layouts": get_tuning_layout.cache_info()._asdict(),
+            "tab_indexes": get_tab_index.cache_info()._asdict(),
+            "hole_indexes": get_hole_index.cache_info()._asdict(),
+            "tuning_charts": get_tuning_chart.cache_info()._asdict()
+        }
+
+    @classmethod
+    def cache_clear(cls):
+        get_tuning_layout.cache_clear()
+        get_tab_index.cache_clear()
+        get_hole_index.cache_clear()
+        get_tuning_chart.cache_clear()
+
+    @property
+    def tab_index(self) -> tuple[str]:
+        """Tuple of tab notation indexed by chromatic pitch ('X' where the pitch is not playable)"""
+        return get_tab_index(self.harmonica_type, self.key)
+
+    def build_tab_index(self) -> tuple[str]:
+        holes_by_pitches = [None] * music.PITCH_COUNT
+        for action, tuning_pitches in self.tuning_pitches.items():
             action_format = self.action_notation[action]
-            for index in range(len(tuning_values)):
-                value = tuning_values[index]
+            for index in range(len(tuning_pitches)):
+                pitch = tuning_pitches[index]
                 value_notation = action_format.format(index + 1)
-                if value in holes_by_pitches.keys():
-                    holes_by_pitches[value] = f"{holes_by_pitches[value]}/{value_notation}"
+                if holes_by_pitches[pitch] is not None:
+                    holes_by_pitches[pitch] = f"{holes_by_pitches[pitch]}/{value_notation}"
                 else:
-                    holes_by_pitches[value] = value_notation
+                    holes_by_pitches[pitch] = value_notation
+        logger.debug(f"built tab index for {self.harmonica_type} in key {self.key}")
+        return tuple('X' if value is None else value for value in holes_by_pitches)
+
+    @property
+    def hole_index(self) -> tuple[tuple[Hole]]:
+        """Tuple of the candidate Holes for each chromatic pitch (empty where the pitch is not playable)"""
+        return get_hole_index(self.harmonica_type, self.key)
+
+    def build_hole_index(self) -> tuple[tuple[Hole]]:
+        holes_by_pitches = [[] for _ in range(music.PITCH_COUNT)]
+        for action, tuning_pitches in self.tuning_pitches.items():
+            action_format = self.action_notation[action]
+            breath, _, slide = action.partition(" ")
+            for index in range(len(tuning_pitches)):
+                holes_by_pitches[tuning_pitches[index]].append(
+                    Hole(index + 1, action, breath, slide, action_format.format(index + 1)))
+        logger.debug(f"built hole index for {self.harmonica_type} in key {self.key}")
+        return tuple(tuple(holes) for holes in holes_by_pitches)
+
+    def get_optimal_notation(self, notes: (list[int], tuple[int], list[str])) -> list[str]:
+        """Like get_notation, but picks one hole per note where a pitch can be played on several holes (see
+        optimizer.HolePathOptimizer)"""
+        from harp_helper.optimizer import HolePathOptimizer
+        if len(notes) and isinstance(notes[0], str):
+            notes = music.find_note_indices(" ".join(notes))
+        hole_index = self.hole_index
+        return HolePathOptimizer().render([hole_index[n] for n in notes])
+
+    def get_notation(self, notes: (list[int], tuple[int], list[str])):
+        """"Accepts a sequence of chromatic pitches (or note strings) and outputs list of strings in harmonica
+        tablature """
+        if len(notes) and isinstance(notes[0], str):
+            notes = music.find_note_indices(" ".join(notes))
+        tab_index = self.tab_index
+        return [tab_index[n] for n in notes]
 
-        return [holes_by_pitches.get(n, 'X') for n in notes]
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def get_tuning_layout(harmonica_type: str, key: str) -> tuple[MappingProxyType, MappingProxyType]:
+    """Builds the immutable (notes, pitches) tuning layout of a harmonica type in a key"""
+    harp = Harmonica(harmonica_type, key)
+    notes = {action: tuple(values) for action, values in harp.build_tuning_values().items()}
+    pitches = {action: tuple(music.find_note_index(n) for n in values) for action, values in notes.items()}
+    logger.debug(f"built tuning layout for {harmonica_type} in key {key}")
+    return MappingProxyType(notes), MappingProxyType(pitches)
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def get_tab_index(harmonica_type: str, key: str) -> tuple[str]:
+    """Builds the immutable pitch -> tab notation tuple of a harmonica type in a key"""
+    return Harmonica(harmonica_type, key).build_tab_index()
+
+
+def tuning_chart_rows(harmonica_type: str,
+                      key: str,
+                      use_music_symbols: bool = True,
+                      transpose_steps: int = 0,
+                      transpose_key: (None, str) = None) -> tuple[list, list]:
+    """Returns the (headers, rows) of the tuning chart of a harmonica type in a key, from its integer layout
+
+    Transposing shifts the pitches and spells them in transpose_key (or key).
+    """
+    steps = transpose_steps
+    spelling_key = key
+    if transpose_key is not None:
+        steps += music.KeySignature(key).get_transposition_half_steps(transpose_key)
+        spelling_key = music.KeySignature(transpose_key).notation
+    if use_music_symbols:
+        names = music.get_musical_name_table(spelling_key)
+    else:
+        names = music.get_scale_notation_table(spelling_key)
+
+    rows = []
+    for label, pitches in get_tuning_layout(harmonica_type, key)[1].items():
+        row = music.MusicExpression.from_pitches(pitches, key).transposed(steps)
+        rows.append([label] + row.render(names))
+
+    headers = list(range(1, max([len(row) for row in rows])))
+    headers.insert(0, "")
+    return headers, rows
+
+
+@lru_cache(maxsize=CHART_CACHE_SIZE)
+def get_tuning_chart(harmonica_type: str,
+                     key: str,
+                     output_format: str = "table",
+                     use_music_symbols: bool = True,
+                     transpose_steps: int = 0,
+                     transpose_key: (None, str) = None,
+                     title: (None, str) = None) -> str:
+    """Renders the tuning chart of a harmonica type in a key with the writer for output_format
+
+    Rendered charts are kept in an LRU cache, so asking for the same chart again is a lookup.
+    """
+    from harp_helper import writers
+    writer = writers.get_writer(output_format, io.StringIO())
+    headers, rows = tuning_chart_rows(harmonica_type, key, use_music_symbols, transpose_steps, transpose_key)
+    writer.write_table(headers, rows, title=title)
+    writer.close()
+    return writer.sink.getvalue().rstrip("\n")
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def get_hole_index(harmonica_type: str, key: str) -> tuple[tuple[Hole]]:
+    """Builds the immutable pitch -> candidate Holes tuple of a harmonica type in a key"""
+    return Harmonica(harmonica_type, key).build_hole_index()
 
 
 # -------------------------------------------------------------------
-# Search through modules in this package for subclasses of Harmonica
+# Lazy discovery of Harmonica subclasses: modules in this package first,
+# then entry points installed by other distributions
 # -------------------------------------------------------------------
-for mod in [m for m in pkgutil.iter_modules(path=__path__) if not m.name.startswith("_")]:
-    import_module(f"{__name__}.{mod.name}")
+_builtins_discovered = False
+_entry_points_discovered = False
+
+
+def discover_builtin_harmonicas():
+    """Imports every module in this package (each Harmonica subclass registers itself)"""
+    global _builtins_discovered
+    if _builtins_discovered:
+        return
+    import pkgutil
+    for mod in [m for m in pkgutil.iter_modules(path=__path__) if not m.name.startswith("_")]:
+        import_module(f"{__name__}.{mod.name}")
+    _builtins_discovered = True
+
+
+def discover_entry_point_harmonicas(harmonica_type: (None, str) = None):
+    """Loads harmonica entry points (only the one named harmonica_type if given)"""
+    global _entry_points_discovered
+    if _entry_points_discovered:
+        return
+    from importlib import metadata
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        entry_points = entry_points.get(ENTRY_POINT_GROUP, ())
+    for entry_point in entry_points:
+        if harmonica_type is not None and entry_point.name.lower() != harmonica_type:
+            continue
+        try:
+            entry_point.load()
+        except Exception as e:
+            logger.warning(f"Unable to load harmonica entry point {entry_point.name}: {e}")
+    if harmonica_type is None:
+        _entry_points_discovered = True
+
+
+def discover_harmonicas():
+    discover_builtin_harmonicas()
+    discover_entry_point_harmonicas()
+
+
+def get_harmonica_class(harmonica_type: str):
+    """Returns the Harmonica subclass registered for harmonica_type, discovering harmonicas on a miss"""
+    harmonica_type = harmonica_type.lower()
+    harmonica_class = Harmonica._registry.get(harmonica_type)
+    if harmonica_class is None:
+        discover_builtin_harmonicas()
+        harmonica_class = Harmonica._registry.get(harmonica_type)
+    if harmonica_class is None:
+        discover_entry_point_harmonicas(harmonica_type)
+        harmonica_class = Harmonica._registry.get(harmonica_type)
+    if harmonica_class is None:
+        raise NotImplementedError(f"Harmonica type {harmonica_type}")
+    return harmonica_class
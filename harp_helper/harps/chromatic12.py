@@ -14,8 +14,7 @@ class Chromatic12(Harmonica):
         "draw <": "-{}<"
     }
 
-    @property
-    def tuning_values(self):
+    def build_tuning_values(self):
         return {
             "blow >":  self.hole_values(
                 starting_note=self.lowest_note,
@@ -43,6 +42,4 @@ class Chromatic12(Harmonica):
 
     @property
     def highest_note(self) -> str:
-        note = music.MusicExpression(self.lowest_note)
-        note.transpose_half_steps(38)
-        return note.notation
+        return music.MusicExpression(self.lowest_note, key=self._key.notation).transposed(38).notation
@@ -19,8 +19,7 @@ class Diatonic10(Harmonica):
     def highest_note(self) -> str:
         return f"{self._key.notation}''''"
 
-    @property
-    def tuning_values(self):
+    def build_tuning_values(self):
         return {
             "blow": self.hole_values(
                 starting_note=self.lowest_note,
@@ -0,0 +1,160 @@
+"""
+incremental.py - Line by line transcription cache for re-transcribing edited notation
+
+The tabs of a line depend only on its text, the key in effect where it starts (a \\key command on an earlier
+line carries over) and the harmonica settings. LineCache keeps each line's tabs under that triple, with the
+key in effect after the line, so transcribing a document again after an edit only tokenizes and transcribes
+the lines whose text or starting key changed; every other line is a lookup.
+
+TabLineUpdate turns the lines on display into the lines of a new transcription with as few edits as
+possible: lines matching at the start are left alone, lines past the end are appended as they arrive and
+only the changed run in between (found once the common tail is known) is replaced.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import threading
+import time
+
+from harp_helper import engine
+from harp_helper.harps import Harmonica
+from harp_helper import instrument
+from harp_helper import tokenizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_LINES = 100_000
+
+
+@dataclass(frozen=True)
+class TabLine:
+    """The rendered phrases of one line of notation (key identifies the line's text, start key and settings)"""
+    key: tuple
+    phrases: tuple
+    end_key: (None, str)
+
+
+class LineCache:
+    """Least recently used cache of TabLines, shared by successive transcriptions
+
+    render turns the tab notation of each phrase (a list of str) into what is kept and displayed (the list
+    itself by default). It is only called for lines that are not cached.
+    """
+
+    def __init__(self, max_lines: int = DEFAULT_MAX_LINES, render=None):
+        self.max_lines = max_lines
+        self.render = render
+        self.hits = 0
+        self.misses = 0
+        self._lines = OrderedDict()
+        # Transcriptions run on worker threads; a cancelled one may still be finishing when the next starts
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def transcribe(self,
+                   lines,
+                   harmonica_type: str,
+                   harmonica_key: str = "c",
+                   source_key: (None, str) = None,
+                   transpose_steps: int = 0,
+                   direction: str = "closest"):
+        """Generator for yielding a TabLine for each line of notation, transcribing only the lines not cached
+
+        When instrumented, reading lines and tokenizing the lines not cached are timed as the read and tokenize
+        stages (engine.transcribe times the rest).
+        """
+        timing = instrument.enabled
+        if timing:
+            lines = instrument.timed(lines, "read")
+        harp = Harmonica(harmonica_type=harmonica_type, harmonica_key=harmonica_key)
+        settings = (harmonica_type, harmonica_key, source_key, transpose_steps, direction)
+        render = self.render
+        cached = self._lines
+        lock = self._lock
+        key = None
+        for line_number, line in enumerate(lines, 1):
+            cache_key = (settings, key, line)
+            with lock:
+                tab_line = cached.get(cache_key)
+                if tab_line is not None:
+                    cached.move_to_end(cache_key)
+                    self.hits += 1
+            if tab_line is None:
+                if timing:
+                    start = time.perf_counter()
+                phrases, end_key = tokenizer.tokenize_line(line, key, line_number)
+                if timing:
+                    instrument.lap("tokenize", start)
+                tabs = engine.transcribe(phrases, harp, source_key, transpose_steps, direction)
+                tab_line = TabLine(cache_key, tuple(tabs if render is None else map(render, tabs)), end_key)
+                with lock:
+                    self.misses += 1
+                    cached[cache_key] = tab_line
+                    if len(cached) > self.max_lines:
+                        cached.popitem(last=False)
+            key = tab_line.end_key
+            yield tab_line
+
+
+class TabLineUpdate:
+    """Edits that turn the TabLines on display into those of a new transcription
+
+    An edit is (position, count, phrases): replace count phrases from phrase number position with phrases.
+    Feed the new lines in order to add(), applying each edit it returns, then apply the edit from finish().
+    shown always lists the lines on display once the edits returned so far are applied.
+    """
+
+    def __init__(self, shown: list):
+        self.shown = list(shown)
+        # Leading lines of shown that are up to date, and the number of phrases in them
+        self.matched = 0
+        self.position = 0
+        # New lines held back from the first changed line until the common tail is known
+        self.pending = None
+
+    def add(self, tab_lines) -> (None, tuple):
+        """Takes the next new TabLines, returning the edit that appends any lines past the end of shown"""
+        appended = []
+        for tab_line in tab_lines:
+            if self.pending is not None:
+                self.pending.append(tab_line)
+            elif self.matched < len(self.shown):
+                if self.shown[self.matched].key == tab_line.key:
+                    self.matched += 1
+                    self.position += len(tab_line.phrases)
+                else:
+                    self.pending = [tab_line]
+            else:
+                appended.append(tab_line)
+        phrases = [phrase for tab_line in appended for phrase in tab_line.phrases]
+        self.shown.extend(appended)
+        self.matched += len(appended)
+        position = self.position
+        self.position += len(phrases)
+        return (position, 0, phrases) if phrases else None
+
+    def finish(self) -> (None, tuple):
+        """Returns the edit replacing the changed run of lines (or removing lines no longer there)"""
+        changed = self.pending or []
+        old = self.shown[self.matched:]
+        tail = 0
+        while tail < len(old) and tail < len(changed) and old[-1 - tail].key == changed[-1 - tail].key:
+            tail += 1
+        removed = old[:len(old) - tail]
+        added = changed[:len(changed) - tail]
+        self.shown[self.matched:self.matched + len(removed)] = added
+        self.pending = None
+        count = sum(len(tab_line.phrases) for tab_line in removed)
+        phrases = [phrase for tab_line in added for phrase in tab_line.phrases]
+        if not count and not phrases:
+            return None
+        logger.debug(f"replacing {len(removed)} changed lines with {len(added)} lines")
+        return self.position, count, phrases
@@ -0,0 +1,123 @@
+"""
+instrument.py - Per-stage timing of the transcription pipeline
+
+Disabled by default. Code on the hot path checks the module level 'enabled' flag once per phrase (or wraps
+its iterables only when enabled), so disabled instrumentation costs nothing measurable.
+
+Stages:
+    read       reading lines of the source
+    tokenize   turning lines into phrases of pitches
+    key        key changes and building the expression for each phrase
+    transpose  transposing to the harmonica key
+    tab        looking up the tab notation
+    render     formatting and writing the output
+"""
+import json
+import threading
+import time
+
+STAGES = ("read", "tokenize", "key", "transpose", "tab", "render")
+HISTOGRAM_BUCKETS = 32
+
+enabled = False
+_stats = {}
+_local = threading.local()
+
+
+class StageStats:
+    """Count, total, min/max and a log2 histogram (in microseconds) of the time spent in a stage"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.histogram = [0] * HISTOGRAM_BUCKETS
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_seconds": self.total / self.count if self.count else 0.0,
+            "min_seconds": self.min or 0.0,
+            "max_seconds": self.max,
+            "histogram_us": {
+                f"<{1 << bucket}": count for bucket, count in enumerate(self.histogram) if count
+            }
+        }
+
+
+def enable(state: bool = True):
+    global enabled
+    enabled = state
+
+
+def reset():
+    _stats.clear()
+
+
+def record(stage: str, seconds: float):
+    stats = _stats.get(stage)
+    if stats is None:
+        stats = _stats[stage] = StageStats()
+    stats.add(seconds)
+
+
+def lap(stage: str, start: float) -> float:
+    """Records the time since start against stage and returns the current time (the start of the next lap)"""
+    now = time.perf_counter()
+    record(stage, now - start)
+    return now
+
+
+def timed(iterable, stage: str):
+    """Generator for yielding the items of iterable, recording the time spent producing each one
+
+    Time spent in nested timed iterables is recorded against their own stage only.
+    """
+    iterator = iter(iterable)
+    while True:
+        outer_nested = getattr(_local, "nested", 0.0)
+        _local.nested = 0.0
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            _local.nested = outer_nested
+            return
+        elapsed = time.perf_counter() - start
+        record(stage, elapsed - _local.nested)
+        _local.nested = outer_nested + elapsed
+        yield item
+
+
+def as_dict() -> dict:
+    return {stage: _stats[stage].as_dict() for stage in STAGES + tuple(sorted(set(_stats) - set(STAGES)))
+            if stage in _stats}
+
+
+def dumps() -> str:
+    return json.dumps(as_dict(), indent=2)
+
+
+def report() -> str:
+    """Plain text table of the recorded stages"""
+    stats = as_dict()
+    if not stats:
+        return "No timings recorded (enable Debug and run a transcription)"
+    total = sum(stage["total_seconds"] for stage in stats.values()) or 1.0
+    lines = [f"{'stage':10} {'count':>10} {'total ms':>12} {'share':>7} {'mean us':>10} {'max us':>10}"]
+    for name, stage in stats.items():
+        lines.append(f"{name:10} {stage['count']:>10} {stage['total_seconds'] * 1000:>12.2f} "
+                     f"{stage['total_seconds'] / total:>7.1%} {stage['mean_seconds'] * 1e6:>10.1f} "
+                     f"{stage['max_seconds'] * 1e6:>10.1f}")
+    return "\n".join(lines)
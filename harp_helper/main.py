@@ -1,18 +1,24 @@
-from dataclasses import dataclass
+from importlib import import_module
 import logging
 import os
 import sys
+import time
 import traceback
 
-from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QFileDialog, QMenuBar
-from PyQt6.QtGui import QAction
-from PyQt6.QtCore import QRect
-from PyQt6 import uic
+from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QFileDialog, QMenuBar, QProgressBar, QPushButton
+from PyQt6.QtGui import QAction, QTextCursor
+from PyQt6.QtCore import QRect, QThreadPool, QTimer
 
 
 from harp_helper import constants
+from harp_helper import engine
 from harp_helper.harps import Harmonica
+from harp_helper import incremental
+from harp_helper import instrument
 from harp_helper import music
+from harp_helper import transcription_cache
+from harp_helper.workers import Worker
+from harp_helper import writers
 
 logger = logging.getLogger('harp')
 
@@ -20,32 +26,47 @@ logger = logging.getLogger('harp')
 MAX_FILE_LABEL_TEXT = 65
 WINDOW_MARGIN = 20
 WINDOW_FOOTER = 20
-MINOR_KEY_SIGNATURES = {
-    'a': 'c',
-    'ais': 'cis',
-    'bes': 'des',
-    'b': 'd',
-    'c': 'ees',
-    'cis': 'e',
-    'd': 'f',
-    'dis': 'fis',
-    'ees': 'ges',
-    'e': 'g',
-    'f': 'aes',
-    'fis': 'a',
-    'g': 'bes',
-    'gis': 'b'
-}
+MAX_MESSAGE_BLOCKS = 5000
+# Milliseconds of quiet typing before a live tab update
+LIVE_TAB_DELAY = 250
+TAB_SEPARATOR = " \u2666 "
 
 current_path = os.path.dirname(__file__)
-main_ui = os.path.join(current_path, 'ui', 'main_window.ui')
-explorer_ui = os.path.join(current_path, 'ui', 'explorer_widget.ui')
-message_ui = os.path.join(current_path, 'ui', 'message_widget.ui')
+
+
+def load_ui(name: str, widget: QWidget):
+    """Builds the widgets of ui/<name>.ui onto widget
+
+    Uses the module precompiled at build time (harp_helper.ui.<name>_ui) and falls back to parsing the .ui
+    XML at runtime when it is not available.
+    """
+    try:
+        module = import_module(f"harp_helper.ui.{name}_ui")
+    except ImportError:
+        logger.debug(f"precompiled ui module for {name} not found: loading {name}.ui")
+        from PyQt6 import uic
+        uic.loadUi(os.path.join(current_path, 'ui', f'{name}.ui'), widget)
+        return
+    ui_class = next(getattr(module, attr) for attr in dir(module) if attr.startswith("Ui_"))
+    ui = ui_class()
+    ui.setupUi(widget)
+    for attr, value in vars(ui).items():
+        setattr(widget, attr, value)
+
+
+def render_tab_phrase(tabs: list[str]) -> str:
+    """Text of one phrase in the tab browser"""
+    if not instrument.enabled:
+        return TAB_SEPARATOR.join(tabs)
+    start = time.perf_counter()
+    phrase = TAB_SEPARATOR.join(tabs)
+    instrument.lap("render", start)
+    return phrase
 
 
 class HarpHelperUi(QMainWindow):
 
-    app = QApplication(sys.argv)
+    app = None
 
     def gui_exception_handler(func):
         """Decorator for showing exceptions in a message box"""
@@ -60,19 +81,33 @@ class HarpHelperUi(QMainWindow):
         return exception_wrapper
 
     def __init__(self):
+        self.create_app()
         super().__init__()
-        uic.loadUi(main_ui, self)
+        load_ui("main_window", self)
         self.last_dir = os.getenv('HOME')
         self._tab_source_file_name = ""
 
+        # Tabs are kept per source line so Go (or live typing) only transcribes the lines that changed
+        self.tab_cache = incremental.LineCache(render=render_tab_phrase)
+        self._tab_lines = []
+        self._tab_settings = None
+        self.tabBrowser.setUndoRedoEnabled(False)
+        # Finished transcriptions are kept on disk, so Go on an unchanged source skips transcribing it
+        self.transcription_cache = transcription_cache.TranscriptionCache()
+        self._live_timer = QTimer(self)
+        self._live_timer.setSingleShot(True)
+        self._live_timer.setInterval(LIVE_TAB_DELAY)
+        self._live_timer.timeout.connect(self.live_tab_update)
+
         # Main Window Appearance
         self.setWindowTitle(constants.FULL_RELEASE_NAME)
         self.add_menu_bar()
+        self.add_progress_widgets()
         self.update_harps()
         self.chartBox.addItems(('Tune', 'Transpose'))
         self.sourceKeyCheckBox.setChecked(False)
         self.update_tab_source_keys()
-        self.outputComboBox.addItems(('table', 'csv'))
+        self.outputComboBox.addItems(writers.output_formats())
 
         # Perform connections
         self.main_window_connections()
@@ -81,6 +116,18 @@ class HarpHelperUi(QMainWindow):
         self.explorer = None
         self.message = None
 
+        # Background jobs
+        self.thread_pool = QThreadPool.globalInstance()
+        self._workers = {}
+        self._running = set()
+
+    @classmethod
+    def create_app(cls) -> QApplication:
+        """Creates the QApplication (must happen before any widget is constructed)"""
+        if cls.app is None:
+            cls.app = QApplication.instance() or QApplication(sys.argv)
+        return cls.app
+
     @classmethod
     def exec(cls):
         sys.exit(cls.app.exec())
@@ -99,6 +146,18 @@ class HarpHelperUi(QMainWindow):
         saveAction.setStatusTip("Save the current output to a file")
         saveAction.triggered.connect(self.save_output_dialog)
 
+        # Find Best Harp
+        bestHarpAction = QAction("Find Best Harp...", self)
+        bestHarpAction.setStatusTip("Rank harmonica types, keys and octave transpositions for the tab source")
+        bestHarpAction.triggered.connect(self.best_harp_click)
+
+        # Live Tab
+        self._liveTabAction = QAction("Live Tab", self)
+        self._liveTabAction.setCheckable(True)
+        self._liveTabAction.setChecked(False)
+        self._liveTabAction.setStatusTip("Update the tab while the music expression is typed")
+        self._liveTabAction.toggled.connect(self.expression_changed)
+
         # HelpNotation
         notationAction = QAction("Notation...", self)
         notationAction.setStatusTip("Music expression notation help")
@@ -111,17 +170,38 @@ class HarpHelperUi(QMainWindow):
         self._debugAction.setStatusTip("Toggle debug mode")
         self._debugAction.toggled.connect(self.toggle_debug)
 
+        # Timings
+        timingsAction = QAction("Timings...", self)
+        timingsAction.setStatusTip("Show the time spent in each transcription stage (recorded in debug mode)")
+        timingsAction.triggered.connect(self.help_timings_message)
+
         self.statusBar()
 
         mainMenu = QMenuBar()
         fileMenu = mainMenu.addMenu('&File')
         fileMenu.addAction(exitAction)
         fileMenu.addAction(saveAction)
+        toolsMenu = mainMenu.addMenu('Tools')
+        toolsMenu.addAction(bestHarpAction)
+        toolsMenu.addAction(self._liveTabAction)
         helpMenu = mainMenu.addMenu('Help')
         helpMenu.addAction(notationAction)
         helpMenu.addAction(self._debugAction)
+        helpMenu.addAction(timingsAction)
         self.setMenuBar(mainMenu)
 
+    def add_progress_widgets(self):
+        self.progressBar = QProgressBar()
+        self.progressBar.setRange(0, 100)
+        self.progressBar.setMaximumWidth(200)
+        self.progressBar.hide()
+        self.cancelButton = QPushButton("Cancel")
+        self.cancelButton.setStatusTip("Cancel the running job")
+        self.cancelButton.clicked.connect(lambda: self.cancel_job())
+        self.cancelButton.hide()
+        self.statusBar().addPermanentWidget(self.progressBar)
+        self.statusBar().addPermanentWidget(self.cancelButton)
+
     def main_window_connections(self):
         # Chart Widgets
         self.generateChartButton.clicked.connect(self.report_button_click)
@@ -131,6 +211,7 @@ class HarpHelperUi(QMainWindow):
         self.sourceFileButton.clicked.connect(self.tab_file_radio_button_click)
         self.sourceKeyCheckBox.stateChanged.connect(self.update_tab_source_keys)
         self.fileExplorerButton.clicked.connect(self.open_file_dialog)
+        self.expressionEdit.textChanged.connect(self.expression_changed)
         # --- Keep source key sync'd with harp key if unchecked!
         self.harpKeyBox.currentIndexChanged.connect(self.update_tab_source_keys)
         # General Widgets
@@ -231,68 +312,68 @@ class HarpHelperUi(QMainWindow):
 
     @gui_exception_handler
     def go_button_click(self, *args):
+        self.start_tab_job(use_cache=True)
 
-        self.tabBrowser.clear()
+    @gui_exception_handler
+    def live_tab_update(self, *args):
+        if self._liveTabAction.isChecked() and self.sourceExpressionButton.isChecked():
+            # Half typed notation is expected: errors go to the status bar rather than a message window
+            self.start_tab_job(on_error=lambda message: self.statusBar().showMessage(message.strip().splitlines()[-1]))
 
-        harp = Harmonica(
-            harmonica_type=self.typeBox.currentData(),
-            harmonica_key=self.harpKeyBox.currentData()
-        )
+    def expression_changed(self, *args):
+        if self._liveTabAction.isChecked() and self.sourceExpressionButton.isChecked():
+            self._live_timer.start()
 
-        if self.sourceKeyCheckBox.isChecked():
-            source_key = self.sourceKeyBox.currentData()
-        else:
-            source_key = harp.key
-        logger.debug(f"initial source key is {source_key}")
-        details = []
-        for music_data in self.generate_music_data_structure_from_source():
-
-            if music_data.key is not None:
-                source_key = music_data.key
-                logger.debug(f"setting source key to {source_key}")
-            source_notes = " ".join(music_data.events)
-
-            expression = music.MusicExpression(source_notes, key=source_key)
-
-            if self.transposeSpinner.value() != 0:
-                logger.debug(f"transposing half-steps={self.transposeSpinner.value()}")
-                expression.transpose_half_steps(self.transposeSpinner.value())
-
-            if self.transposeDownButton.isChecked():
-                direction = "down"
-            elif self.transposeUpButton.isChecked():
-                direction = "up"
-            else:
-                direction = "closest"
-            if source_key != harp.key:
-                logger.debug(f"transposing from key {expression.key}"
-                             f" to key {self.harpKeyBox.currentData()}"
-                             f" direction: {direction}")
-                expression.transpose_to_key(
-                    key=self.harpKeyBox.currentData(),
-                    direction=direction
-                )
+    @gui_exception_handler
+    def best_harp_click(self, *args):
+        """Selects the best harmonica type, key and transposition for the tab source and shows the ranking"""
+        from harp_helper import search
 
-            # Create the notation
-            phrase = " &diams; ".join(harp.get_notation(expression.notation_list))
-            logger.debug(f"adding phrase '{phrase}'")
-            details.append(phrase.replace("<", "&lt;"))
+        lines, _ = self.get_tab_source()
+        scores = search.rank_harps(search.pitch_histograms(engine.generate_phrases(lines)))
+        if not scores:
+            return
+        best = scores[0]
+        self.typeBox.setCurrentIndex(self.typeBox.findData(best.harmonica_type))
+        self.harpKeyBox.setCurrentIndex(self.harpKeyBox.findData(best.harmonica_key))
+        self.sourceKeyCheckBox.setChecked(False)
+        self.transposeSpinner.setValue(best.transpose_steps)
 
-        self.tabBrowser.setHtml("\n<br>\n".join(details))
+        rows = [f"{'harmonica':28} {'steps':>5} {'unplayable':>10} {'out of range':>12}"]
+        for score in scores[:10]:
+            harp = Harmonica(score.harmonica_type, score.harmonica_key)
+            rows.append(f"{harp.name:28} {score.transpose_steps:>5} {score.unplayable:>10} {score.out_of_range:>12}")
+        self.open_message(title="Best Harp", message=f"<pre>{chr(10).join(rows)}</pre>", html=True)
 
     @gui_exception_handler
     def report_button_click(self, *args):
+        self.cancel_job("chart")
         chart_type = self.chartBox.currentText()
+        output_format = self.outputComboBox.currentText()
         if chart_type == "Tune":
             harp = Harmonica(
                 harmonica_type=self.typeBox.currentData(),
                 harmonica_key=self.harpKeyBox.currentData()
             )
-            output = harp.tuning_chart(output_format=self.outputComboBox.currentText())
-        else:
-            output = self.create_transposing_charts()
-        self.chartBrowser.setText(output)
+            chart = harp.tuning_chart(output_format=output_format)
+            if output_format == "html":
+                self.chartBrowser.setHtml(chart)
+            else:
+                self.chartBrowser.setPlainText(chart)
+            return
 
+        self.chartBrowser.clear()
+        harmonica_type = self.typeBox.currentData()
+        worker = Worker(
+            music.KEYS,
+            lambda keys: engine.generate_transposing_charts(harmonica_type, output_format, keys),
+            total=len(music.KEYS),
+            batch_size=1
+        )
+        if output_format == "html":
+            self.start_job("chart", worker, self.append_chart_html_batch)
+        else:
+            self.start_job("chart", worker, self.append_chart_batch)
 
     @gui_exception_handler
     def tab_file_radio_button_click(self, *args):
@@ -314,77 +395,127 @@ class HarpHelperUi(QMainWindow):
     def help_notation_message(self, *args):
         self.open_message(title="Help: Music Notation", message=constants.NOTATION_HELP, html=True)
 
+    @gui_exception_handler
+    def help_timings_message(self, *args):
+        self.open_message(title="Timings", message=f"<pre>{instrument.report()}</pre>", html=True)
+
     @gui_exception_handler
     def toggle_debug(self, *args):
         if self._debugAction.isChecked():
             logging.getLogger().setLevel(logging.DEBUG)
+            instrument.reset()
+            instrument.enable(True)
         else:
             logging.getLogger().setLevel(logging.INFO)
+            instrument.enable(False)
 
     # \\\\\\\ Helper Functions For Main Window ///////
 
-    def generate_tab_notation_from_source(self):
-        """Generator for yielding a line of notation"""
-        if self.sourceExpressionButton.isChecked():
-            yield self.expressionEdit.text()
+    @property
+    def transpose_direction(self) -> str:
+        if self.transposeDownButton.isChecked():
+            return "down"
+        elif self.transposeUpButton.isChecked():
+            return "up"
+        return "closest"
+
+    @property
+    def transcription_options(self) -> dict:
+        """Keyword arguments of engine.write_transcription for the current harmonica and transposing settings"""
+        harmonica_key = self.harpKeyBox.currentData()
+        return {
+            "harmonica_type": self.typeBox.currentData(),
+            "harmonica_key": harmonica_key,
+            "source_key": self.sourceKeyBox.currentData() if self.sourceKeyCheckBox.isChecked() else harmonica_key,
+            "transpose_steps": self.transposeSpinner.value(),
+            "direction": self.transpose_direction
+        }
+
+    def start_tab_job(self, on_error=None, use_cache: bool = False):
+        """Transcribes the tab source into tabBrowser, editing only the phrases of lines that changed
+
+        Lines are looked up in tab_cache, so only new or edited lines (or lines after a changed \\key) are
+        transcribed again. The browser starts over when the source or harmonica settings change. With
+        use_cache, the worker first looks the source up in transcription_cache (see cached_tab_lines).
+        """
+        self.cancel_job("tab")
+        self.statusBar().clearMessage()
+        options = self.transcription_options
+        settings = (self.sourceExpressionButton.isChecked(), self._tab_source_file_name, options)
+        if settings != self._tab_settings:
+            self.tabBrowser.clear()
+            self._tab_lines = []
+            self._tab_settings = settings
+
+        lines, total = self.get_tab_source()
+        update = incremental.TabLineUpdate(self._tab_lines)
+        job = {}
+        if use_cache:
+            job["cached"] = None
+            if self.sourceExpressionButton.isChecked():
+                source = (self.expressionEdit.text(), None)
+            else:
+                source = (None, self._tab_source_file_name)
+
+        def process(lines):
+            if use_cache:
+                return self.cached_tab_lines(lines, options, *source, worker, job)
+            return self.tab_cache.transcribe(lines, **options)
+
+        worker = Worker(lines, process, total=total, measure=len)
+        self.start_job(
+            "tab",
+            worker,
+            lambda tab_lines: self.update_tab_batch(update, tab_lines),
+            on_error=on_error,
+            on_finished=lambda: self.finish_tab_update(worker, update, job)
+        )
+
+    def cached_tab_lines(self,
+                         lines,
+                         options: dict,
+                         expression: (None, str),
+                         file_name: (None, str),
+                         worker: Worker,
+                         job: dict):
+        """Generator run by the tab worker: yields the TabLines of the cached transcription of the tab source
+        (expression, or else the file), or transcribes lines and stores them in transcription_cache as it goes
+
+        Hashing the source and reading or writing the entry all happen on the worker thread. Cached phrases are
+        TabLines of their own (keyed by entry and phrase number), so the next transcription replaces them.
+        job["cached"] is set to whether the tabs came from the cache.
+        """
+        cache = self.transcription_cache
+        if expression is not None:
+            state = None
+            cache_key = transcription_cache.text_cache_key(expression, options)
         else:
-            with open(self._tab_source_file_name, "r") as fh:
-                line = fh.readline()
-                while line:
-                    notation = line.partition("#")[0].strip()
-                    if len(notation) > 0:
-                        yield line.strip()
-                    line = fh.readline()
-
-    def generate_music_data_structure_from_source(self):
-        """Generator for yielding MusicDataClass objects"""
-
-        @dataclass
-        class MusicDataClass:
-            key: str
-            events: list[str]
-
-        key = None
-        for line in self.generate_tab_notation_from_source():
-            logger.debug(f"processing line: {line}")
-            note_events = []
-            event_list = line.split()
-            while len(event_list) > 0:
-
-                # Get the next event
-                event = event_list.pop(0)
-
-                # Check for key signature
-                if event == "\\key":
-                    logger.debug("Found control event key")
-                    try:
-                        key_name = event_list.pop(0)
-                        key_scale = event_list.pop(0)
-                    except IndexError:
-                        raise ValueError("Unable to parse \\key control command") from None
-                    if key_scale not in ("\\major", "\\minor"):
-                        raise ValueError(f"Unsupported mode '{key_scale}'")
-                    if key_scale == "\\minor":
-                        try:
-                            key_name = MINOR_KEY_SIGNATURES[key_name]
-                        except KeyError:
-                            raise ValueError(f"Can't use minor key {key_name}") from None
-
-                    # Before we change the key, yield notes from the previous key
-                    if note_events:
-                        yield MusicDataClass(key, note_events)
-                        note_events = []
-
-                    # Now set the new key and continue
-                    key = key_name
-                    continue
-
-                note_events.append(event)
-
-            # After loop yield remaining events
-            if note_events:
-                yield MusicDataClass(key, note_events)
+            state = transcription_cache.file_state(file_name)
+            cache_key = transcription_cache.file_cache_key(file_name, options)
+        entry = cache.open_entry(cache_key)
+        job["cached"] = entry is not None
+        if entry is not None:
+            with entry:
+                for number, line in enumerate(entry):
+                    phrase = render_tab_phrase(transcription_cache.parse_phrase(line))
+                    yield incremental.TabLine(("cached", cache_key, number), (phrase,), None)
+            return
 
+        with cache.writer(cache_key) as writer:
+            for tab_line in self.tab_cache.transcribe(lines, **options):
+                for phrase in tab_line.phrases:
+                    writer.write_phrase(phrase.split(TAB_SEPARATOR))
+                yield tab_line
+            # Stored only if every line was transcribed and the file did not change meanwhile
+            if not worker.cancelled and (state is None or transcription_cache.file_state(file_name) == state):
+                writer.commit()
+
+    def get_tab_source(self) -> tuple:
+        """Returns the lines of notation to transcribe and their total length in characters"""
+        if self.sourceExpressionButton.isChecked():
+            text = self.expressionEdit.text()
+            return [text], len(text)
+        return engine.generate_file_lines(self._tab_source_file_name), os.path.getsize(self._tab_source_file_name)
 
     def update_file_source_label(self, label_text):
         """Updates tab source file (concatenates as needed)"""
@@ -400,16 +531,115 @@ class HarpHelperUi(QMainWindow):
         self.sourceFileLabel.setText(f"{concat_dir}.../{source_base}")
 
     def create_transposing_charts(self) -> str:
-        chart_outputs = []
-        for key in music.KEYS:
-            harp = Harmonica(
-                harmonica_type=self.typeBox.currentData(),
-                harmonica_key=key
-            )
-            chart_outputs.append(f"Source music: {music.NoteParser(key).musical_name}")
-            chart_outputs.append(harp.tuning_chart(output_format=self.outputComboBox.currentText()))
-            chart_outputs.append("")
-        return "\n".join(chart_outputs)
+        return "\n".join(engine.generate_transposing_charts(
+            self.typeBox.currentData(),
+            self.outputComboBox.currentText()
+        ))
+
+    # \\\\\\\ Background Jobs ///////
+
+    def start_job(self, name: str, worker: Worker, on_batch, on_error=None, on_finished=None):
+        """Runs a worker on the thread pool (replacing any job of the same name), delivering output to on_batch
+
+        Errors are shown in the message window unless on_error is given. on_finished is called when the
+        worker is done, cancelled or not.
+        """
+        if on_error is None:
+            on_error = self.show_traceback
+        self.cancel_job(name)
+        self._workers[name] = worker
+        self._running.add(worker)
+        worker.signals.batch.connect(lambda batch: self._workers.get(name) is worker and on_batch(batch))
+        worker.signals.progress.connect(self.progressBar.setValue)
+        worker.signals.error.connect(on_error)
+        worker.signals.finished.connect(lambda: self.job_finished(name, worker))
+        if on_finished is not None:
+            worker.signals.finished.connect(on_finished)
+        self.progressBar.setValue(0)
+        self.progressBar.show()
+        self.cancelButton.show()
+        self.thread_pool.start(worker)
+
+    def cancel_job(self, name: (None, str) = None):
+        """Cancels the named job (or all jobs); the worker stops at its next item"""
+        for job_name in [name] if name is not None else list(self._workers):
+            worker = self._workers.pop(job_name, None)
+            if worker is not None:
+                worker.cancel()
+        self.update_job_widgets()
+
+    def job_finished(self, name: str, worker: Worker):
+        # Workers are referenced until their (last) finished signal is delivered
+        self._running.discard(worker)
+        if self._workers.get(name) is worker:
+            del self._workers[name]
+        self.update_job_widgets()
+
+    def update_job_widgets(self):
+        if not self._workers:
+            self.progressBar.hide()
+            self.cancelButton.hide()
+
+    def update_tab_batch(self, update: incremental.TabLineUpdate, tab_lines: list):
+        edit = update.add(tab_lines)
+        if edit is not None:
+            self.replace_tab_phrases(*edit)
+        self._tab_lines = update.shown
+
+    def finish_tab_update(self, worker: Worker, update: incremental.TabLineUpdate, job: dict):
+        # A cancelled or failed job leaves the lines it has not reached as they were
+        if worker.cancelled or worker.failed:
+            return
+        edit = update.finish()
+        if edit is not None:
+            self.replace_tab_phrases(*edit)
+        self._tab_lines = update.shown
+        logger.debug(f"tab cache: {self.tab_cache.hits} hits, {self.tab_cache.misses} misses")
+        if job.get("cached") is not None:
+            stats = self.transcription_cache.stats
+            logger.debug(f"transcription cache: {stats}")
+            if job["cached"]:
+                self.statusBar().showMessage(f"Tabs loaded from the transcription cache: {stats}")
+
+    def replace_tab_phrases(self, position: int, count: int, phrases: list[str]):
+        """Replaces count phrases of tabBrowser (one block each) from phrase number position with phrases"""
+        document = self.tabBrowser.document()
+        cursor = QTextCursor(document)
+        text = "\n".join(phrases)
+        if document.isEmpty():
+            cursor.insertText(text)
+            return
+        blocks = document.blockCount()
+        if count == 0:
+            if position < blocks:
+                cursor.setPosition(document.findBlockByNumber(position).position())
+                cursor.insertText(text + "\n")
+            else:
+                cursor.movePosition(QTextCursor.MoveOperation.End)
+                cursor.insertText("\n" + text)
+            return
+        start = document.findBlockByNumber(position).position()
+        last = document.findBlockByNumber(position + count - 1)
+        end = last.position() + last.length() - 1
+        if not phrases:
+            # The removed blocks take a line break with them
+            if position + count < blocks:
+                end += 1
+            elif position > 0:
+                start -= 1
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+        cursor.insertText(text)
+
+    def append_chart_batch(self, charts: list[str]):
+        cursor = self.chartBrowser.textCursor()
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText("\n".join(charts) + "\n")
+
+    def append_chart_html_batch(self, charts: list[str]):
+        cursor = self.chartBrowser.textCursor()
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertHtml("".join(charts))
 
     # \\\\\\\ File Dialog ///////
 
@@ -430,7 +660,9 @@ class HarpHelperUi(QMainWindow):
         else:
             self.sourceExpressionButton.setChecked(True)
 
-    def save_output_dialog(self):
+    @gui_exception_handler
+    def save_output_dialog(self, *args):
+        """Writes the current tab (with the separator of the browser) or chart to a file on a background job"""
         filename, _ = QFileDialog.getSaveFileName(
             parent=self,
             caption="Save output",
@@ -440,47 +672,126 @@ class HarpHelperUi(QMainWindow):
             print("cancelled")
             return
         self.last_dir = os.path.dirname(filename)
-        tabs = (self.chartBrowser, self.tabBrowser)
-        with open(filename, "w") as fh:
-            fh.write(tabs[self.tabWidget.currentIndex()].toPlainText())
+        if self.tabWidget.currentWidget() is self.tab_Tab:
+            # Transcribed again straight to the file rather than copied out of the browser
+            lines, total = self.get_tab_source()
+            options = dict(self.transcription_options, separator=TAB_SEPARATOR)
+
+            def write(sink, source):
+                engine.write_transcription(source, sink, **options)
+        else:
+            lines, total = (), 0
+            chart_options = {
+                "harmonica_type": self.typeBox.currentData(),
+                "output_format": writers.file_output_format(filename, self.outputComboBox.currentText()),
+                "harmonica_key": self.harpKeyBox.currentData() if self.chartBox.currentText() == "Tune" else None
+            }
+
+            def write(sink, source):
+                engine.write_charts(sink, **chart_options)
+
+        worker = Worker(lines, lambda source: self.write_output_file(filename, write, source, worker),
+                        total=total, measure=len)
+        self.start_job("save", worker, lambda saved: self.statusBar().showMessage(f"Saved {saved[-1]}"))
+
+    @staticmethod
+    def write_output_file(file_name: str, write, source, worker: Worker):
+        """Generator run by the save worker: write(sink, source) to a temporary file, renamed to file_name (and
+        yielded) once complete, so a failed or cancelled save leaves no partial file"""
+        temp_file_name = f"{file_name}.tmp{os.getpid()}"
+        try:
+            with open(temp_file_name, "w", encoding="utf-8", buffering=engine.WRITE_BUFFER_SIZE) as fh:
+                write(fh, source)
+            if worker.cancelled:
+                os.remove(temp_file_name)
+                return
+            os.replace(temp_file_name, file_name)
+        except BaseException:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+            raise
+        yield file_name
 
     # \\\\\\\ Scrolling Message Box ///////
 
+    def show_traceback(self, message: str):
+        self.open_message("FATAL ERROR: Traceback", message)
+
     def open_message(self, title: str = "MESSAGE", message: str = "?", html: bool = False):
-        self.message = QWidget()
-        uic.loadUi(message_ui, self.message)
-        self.message.okButton.clicked.connect(self.close_message)
-        self.message.setWindowTitle(title)
+        """Shows a message in the shared message window (plain messages are appended while it is open)"""
+        if self.message is None:
+            self.message = MessageWindow()
         if html:
-            self.message.textBrowser.setHtml(message)
+            self.message.show_html(title, message)
         else:
-            self.message.textBrowser.setText(message)
-        self.message.resizeEvent = self.message_window_resize
-        self.message.show()
+            self.message.add_message(title, message)
 
-    def message_window_resize(self, *args, **kwargs):
-        QMainWindow.resizeEvent(self, *args, **kwargs)
+    def close_message(self):
+        if self.message is not None:
+            self.message.close()
+
+
+class MessageWindow(QWidget):
+    """Scrolling message box created once and reused
+
+    Plain messages that arrive while the window is open are queued and appended together on the next pass
+    of the event loop, so a burst of errors costs one update rather than a window each.
+    """
+
+    def __init__(self):
+        super().__init__()
+        load_ui("message_widget", self)
+        self.okButton.clicked.connect(self.close)
+        self.textBrowser.document().setMaximumBlockCount(MAX_MESSAGE_BLOCKS)
+        self._pending = []
+
+    def show_html(self, title: str, message: str):
+        self._pending.clear()
+        self.setWindowTitle(title)
+        self.textBrowser.setHtml(message)
+        self.show()
+        self.raise_()
+
+    def add_message(self, title: str, message: str):
+        if not self.isVisible():
+            self.textBrowser.clear()
+        if not self._pending:
+            QTimer.singleShot(0, self.flush_messages)
+        self._pending.append(message)
+        self.setWindowTitle(title)
+
+    def flush_messages(self):
+        if not self._pending:
+            return
+        cursor = self.textBrowser.textCursor()
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        if not cursor.atStart():
+            cursor.insertText("\n")
+        cursor.insertText("\n".join(self._pending))
+        self._pending.clear()
+        self.textBrowser.setTextCursor(cursor)
+        self.show()
+        self.raise_()
+
+    def resizeEvent(self, *args, **kwargs):
+        QWidget.resizeEvent(self, *args, **kwargs)
 
         #  Relocate Ok button
-        self.message.okButton.setGeometry(QRect(
-            (self.message.geometry().width() - self.message.okButton.geometry().width()) // 2,
-            self.message.geometry().height() - self.message.okButton.geometry().height() - WINDOW_MARGIN - WINDOW_FOOTER,
-            self.message.okButton.geometry().width(),
-            self.message.okButton.geometry().height()
+        self.okButton.setGeometry(QRect(
+            (self.geometry().width() - self.okButton.geometry().width()) // 2,
+            self.geometry().height() - self.okButton.geometry().height() - WINDOW_MARGIN - WINDOW_FOOTER,
+            self.okButton.geometry().width(),
+            self.okButton.geometry().height()
         ))
 
         # Text Browser
-        self.message.textBrowser.setGeometry(QRect(
+        self.textBrowser.setGeometry(QRect(
             WINDOW_MARGIN,
             WINDOW_MARGIN,
-            self.message.geometry().width() - WINDOW_MARGIN * 2,
-            self.message.okButton.geometry().y() - WINDOW_MARGIN * 2
+            self.geometry().width() - WINDOW_MARGIN * 2,
+            self.okButton.geometry().y() - WINDOW_MARGIN * 2
         ))
 
-    def close_message(self):
-        self.message.close()
-        self.message = None
-
 
 def main():
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,330 @@
+"""
+melody_index.py - Transposition-invariant phrase search over a library of songs
+
+A song is reduced to the chromatic pitches of its notes (phrase after phrase) and each note position to the
+gram of the next gram_length intervals, packed first interval highest into a uint32 (interval + 128 per byte,
+so 0 pads the grams of the last notes of a song). Intervals do not change when a passage is transposed, so
+a phrase in any key has the same grams. The index maps each gram to the (song, offset) positions it starts
+at; a query looks up its rarest gram and compares the candidate passages note for note. A phrase shorter than
+a gram is the range of grams starting with its intervals, found by binary search in the sorted grams.
+
+Layout (little-endian, each array starting on an 8 byte boundary):
+
+    header          magic b"HARPMIDX", version (uint16), gram length (uint16), song count (uint32),
+                    gram count (uint64), posting count (uint64), pitch count (uint64), name table size (uint64)
+    name table      song names, UTF-8, separated by newlines
+    grams           uint32[gram count]          distinct grams, sorted
+    posting starts  uint64[gram count + 1]      offset of each gram's first posting (plus the end offset)
+    postings        uint32[2 * posting count]   (song, note offset) pairs, by gram then song and offset
+    song starts     uint64[song count + 1]      offset of each song's first pitch (plus the end offset)
+    pitches         uint8[pitch count]          chromatic pitch of every note, song after song
+
+MelodyIndex maps the file read-only, so opening even a large library is immediate and processes searching
+the same index share its pages.
+"""
+from array import array
+from bisect import bisect_left
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from harp_helper.harps import Harmonica
+from harp_helper import music
+from harp_helper.search import available_keys, harp_masks
+from harp_helper.songfile import padding
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HARPMIDX"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQQQQ")
+INDEX_FILE_EXTENSION = ".hidx"
+# Intervals per gram: 4 packs into a uint32 and is rare enough in real melodies to leave few candidates
+DEFAULT_GRAM_LENGTH = 4
+MAX_GRAM_LENGTH = 4
+INTERVAL_BIAS = 128
+PLAYABLE_CACHE_SIZE = 4096
+
+
+def melody_grams(pitches, gram_length: int = DEFAULT_GRAM_LENGTH) -> list[int]:
+    """Returns the gram of each note position of pitches but the last (see the module docstring)"""
+    codes = [b - a + INTERVAL_BIAS for a, b in zip(pitches, pitches[1:])] + [0] * (gram_length - 1)
+    mask = (1 << 8 * gram_length) - 1
+    gram = 0
+    for code in codes[:gram_length - 1]:
+        gram = gram << 8 | code
+    grams = []
+    # Each gram is the previous one shifted a byte left, with the next interval in the low byte
+    for code in codes[gram_length - 1:]:
+        gram = (gram << 8 | code) & mask
+        grams.append(gram)
+    return grams
+
+
+def song_pitches(phrases) -> array:
+    """Chromatic pitches of a song's tokenizer.Phrase objects, as written (\\key commands do not move them)"""
+    pitches = array("B")
+    for phrase in phrases:
+        pitches.extend(phrase.pitches)
+    return pitches
+
+
+def write_index(songs, file_name: str, gram_length: int = DEFAULT_GRAM_LENGTH) -> tuple[int, int]:
+    """Indexes (name, pitches) songs into an index file, returning the (song, note) counts
+
+    The postings are gathered in memory and written in gram order. The file is written under a temporary name
+    and renamed into place, so searches never see a partial index.
+    """
+    if not 1 <= gram_length <= MAX_GRAM_LENGTH:
+        raise ValueError(f"gram_length must be between 1 and {MAX_GRAM_LENGTH}, not {gram_length}")
+    names = []
+    song_starts = array("Q", [0])
+    pitches = array("B")
+    postings_by_gram = {}
+    for name, melody in songs:
+        if "\n" in name:
+            raise ValueError(f"Song name {name!r} contains a newline")
+        song = len(names)
+        names.append(name)
+        melody = array("B", melody)
+        for offset, gram in enumerate(melody_grams(melody, gram_length)):
+            postings = postings_by_gram.get(gram)
+            if postings is None:
+                postings = postings_by_gram[gram] = array("I")
+            postings.append(song)
+            postings.append(offset)
+        pitches.extend(melody)
+        song_starts.append(len(pitches))
+
+    grams = array("I", sorted(postings_by_gram))
+    posting_starts = array("Q", [0])
+    for gram in grams:
+        posting_starts.append(posting_starts[-1] + len(postings_by_gram[gram]) // 2)
+    posting_count = posting_starts[-1]
+    name_table = "\n".join(names).encode("utf-8")
+    swap = sys.byteorder != "little"
+    if swap:
+        for values in (grams, posting_starts, song_starts):
+            values.byteswap()
+
+    temp_file_name = f"{file_name}.tmp{os.getpid()}"
+    try:
+        with open(temp_file_name, "wb") as fh:
+            offset = fh.write(HEADER.pack(MAGIC, VERSION, gram_length, len(names), len(grams), posting_count,
+                                          len(pitches), len(name_table)))
+            offset += fh.write(name_table)
+            for block in (grams, posting_starts):
+                offset += fh.write(b"\0" * padding(offset))
+                offset += fh.write(block)
+            offset += fh.write(b"\0" * padding(offset))
+            for gram in sorted(postings_by_gram):
+                postings = postings_by_gram[gram]
+                if swap:
+                    postings.byteswap()
+                offset += fh.write(postings)
+            for block in (song_starts, pitches):
+                offset += fh.write(b"\0" * padding(offset))
+                offset += fh.write(block)
+        os.replace(temp_file_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_file_name):
+            os.remove(temp_file_name)
+        raise
+    logger.debug(f"indexed {len(names)} songs, {len(pitches)} notes, {len(grams)} grams to {file_name}")
+    return len(names), len(pitches)
+
+
+@lru_cache(maxsize=PLAYABLE_CACHE_SIZE)
+def playable_keys(pitches: frozenset, harmonica_type: str) -> tuple[str]:
+    """Available keys of a harmonica type on which Harmonica.get_notation has a hole (not 'X') for every pitch"""
+    keys = []
+    for key in available_keys(harmonica_type):
+        playable = harp_masks(harmonica_type, key)[0]
+        if all(playable[pitch] for pitch in pitches):
+            keys.append(key)
+    return tuple(keys)
+
+
+@dataclass
+class MelodyMatch:
+    song: str
+    # Position of the passage's first note among the notes of the song
+    offset: int
+    # Half-steps from the query to the passage
+    transpose_steps: int
+    pitches: tuple[int]
+    # harmonica type -> keys on which the passage (as written) is fully playable
+    playable: dict = field(default_factory=dict)
+
+    @property
+    def notation(self) -> str:
+        table = music.get_notation_table("es")
+        return " ".join(table[pitch] for pitch in self.pitches)
+
+    def as_dict(self) -> dict:
+        values = asdict(self)
+        values["pitches"] = list(self.pitches)
+        values["playable"] = {harmonica_type: list(keys) for harmonica_type, keys in self.playable.items()}
+        values["notation"] = self.notation
+        return values
+
+
+class MelodyIndex:
+    """Read-only memory mapped melody index (see write_index)"""
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        with open(file_name, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{file_name} is not a melody index")
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except BaseException:
+            self.close()
+            raise
+
+    def _load(self):
+        (magic, version, gram_length, song_count, gram_count, posting_count, pitch_count,
+         name_table_size) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.file_name} is not a melody index")
+        if version != VERSION:
+            raise ValueError(f"{self.file_name}: unsupported melody index version {version}")
+        self._view = memoryview(self._mmap)
+        self.gram_length = gram_length
+        self.song_count = song_count
+        self.posting_count = posting_count
+
+        def take(offset, count, typecode):
+            offset += padding(offset)
+            size = count * array(typecode).itemsize
+            if offset + size > len(self._view):
+                raise ValueError(f"{self.file_name}: melody index is truncated")
+            block = self._view[offset:offset + size]
+            if typecode != "B" and sys.byteorder != "little":
+                values = array(typecode, block.tobytes())
+                values.byteswap()
+                return memoryview(values), offset + size
+            return block.cast(typecode), offset + size
+
+        offset = HEADER.size
+        name_table = bytes(self._view[offset:offset + name_table_size]).decode("utf-8")
+        self.names = name_table.split("\n") if song_count else []
+        offset += name_table_size
+        self._grams, offset = take(offset, gram_count, "I")
+        self._posting_starts, offset = take(offset, gram_count + 1, "Q")
+        self._postings, offset = take(offset, 2 * posting_count, "I")
+        self._song_starts, offset = take(offset, song_count + 1, "Q")
+        self._pitches, offset = take(offset, pitch_count, "B")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.song_count
+
+    def gram_range(self, intervals) -> tuple[int, int]:
+        """Returns the (first, end) index of the grams starting with intervals (at most gram_length of them)"""
+        prefix = 0
+        for interval in intervals:
+            prefix = prefix << 8 | (interval + INTERVAL_BIAS)
+        shift = 8 * (self.gram_length - len(intervals))
+        return (bisect_left(self._grams, prefix << shift),
+                bisect_left(self._grams, (prefix + 1) << shift))
+
+    def candidates(self, intervals) -> tuple[int, int, int]:
+        """Returns (position in the query, first posting, end posting) of the rarest gram of intervals
+
+        Queries with at least gram_length intervals use their rarest whole gram; shorter ones the range of
+        grams they begin.
+        """
+        gram_length = self.gram_length
+        posting_starts = self._posting_starts
+        if len(intervals) < gram_length:
+            first, end = self.gram_range(intervals)
+            return 0, posting_starts[first], posting_starts[end]
+        best = None
+        for position in range(len(intervals) - gram_length + 1):
+            first, end = self.gram_range(intervals[position:position + gram_length])
+            candidate = (position, posting_starts[first], posting_starts[end])
+            if best is None or candidate[2] - candidate[1] < best[2] - best[1]:
+                best = candidate
+                if best[1] == best[2]:
+                    break
+        return best
+
+    def find(self, phrase: (str, list[int], tuple[int]), harmonica_types=None, limit: (None, int) = None):
+        """Returns a MelodyMatch for each passage of the library matching phrase in any key
+
+        phrase is notation (spelled as for music.find_note_indices) or a sequence of chromatic pitches, with at
+        least two notes. Matches come in library order, at most limit of them.
+        """
+        query = music.find_note_indices(phrase) if isinstance(phrase, str) else list(phrase)
+        if len(query) < 2:
+            raise ValueError("A phrase needs at least two notes to search for")
+        if harmonica_types is None:
+            harmonica_types = tuple(Harmonica.types())
+        intervals = [b - a for a, b in zip(query, query[1:])]
+        if any(abs(interval) >= INTERVAL_BIAS for interval in intervals):
+            return []
+        position, first, end = self.candidates(intervals)
+        candidates = zip(self._postings[2 * first:2 * end:2], self._postings[2 * first + 1:2 * end:2])
+        if len(intervals) < self.gram_length:
+            # Postings of several grams: back into library order
+            candidates = sorted(candidates)
+
+        song_starts = self._song_starts
+        pitches = self._pitches
+        length = len(query)
+        # Transposition -> the query's pitches moved by it (None where they leave the pitch range)
+        transposed = {}
+        matches = []
+        for song, offset in candidates:
+            start = song_starts[song] + offset - position
+            if start < song_starts[song] or start + length > song_starts[song + 1]:
+                continue
+            steps = pitches[start] - query[0]
+            expected = transposed.get(steps, False)
+            if expected is False:
+                try:
+                    expected = transposed[steps] = bytes(pitch + steps for pitch in query)
+                except ValueError:
+                    expected = transposed[steps] = None
+            if expected is None or pitches[start:start + length] != expected:
+                continue
+            pitch_set = frozenset(expected)
+            matches.append(MelodyMatch(
+                self.names[song],
+                start - song_starts[song],
+                steps,
+                tuple(expected),
+                {harmonica_type: playable_keys(pitch_set, harmonica_type) for harmonica_type in harmonica_types}
+            ))
+            if limit is not None and len(matches) >= limit:
+                return matches
+        return matches
+
+    def close(self):
+        if self._mmap is None:
+            return
+        for name in ("_grams", "_posting_starts", "_postings", "_song_starts", "_pitches", "_view"):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                try:
+                    view.release()
+                except BufferError:
+                    pass
+        try:
+            self._mmap.close()
+        except BufferError:
+            logger.debug(f"{self.file_name} is still in use: unmapped when released")
+        self._mmap = None
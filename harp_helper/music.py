@@ -1,8 +1,10 @@
 """
 music.py - General music functions
 """
+from functools import lru_cache
 import logging
 import re
+from types import MappingProxyType
 
 FLAT_NOTE_ORDER = ("c", "des", "d", "ees", "e", "f", "ges", "g", "aes", "a", "bes", "b")
 SHARP_NOTE_ORDER = ("c", "cis", "d", "dis", "e", "f", "fis", "g", "gis", "a", "ais", "b")
@@ -11,7 +13,7 @@ SCALES = {
     'c': ('c', 'd', 'e', 'f', 'g', 'a', 'b'),
     'des': ('des', 'ees', 'f', 'ges', 'aes', 'bes', 'c'),
     'd': ('d', 'e', 'fis', 'g', 'a', 'b', 'cis'),
-    'ees': ('ees', 'f', 'ges', 'aes', 'bes', 'c', 'd'),
+    'ees': ('ees', 'f', 'g', 'aes', 'bes', 'c', 'd'),
     'e': ('e', 'fis', 'gis', 'a', 'b', 'cis', 'dis'),
     'f': ('f', 'g', 'a', 'bes', 'c', 'd', 'e'),
     'fis': ('fis', 'gis', 'ais', 'b', 'cis', 'dis', 'eis'),
@@ -22,72 +24,110 @@ SCALES = {
     'b': ('b', 'cis', 'dis', 'e', 'fis', 'gis', 'ais')
 }
 KEYS = list(SCALES.keys())
+KEY_INDEX = {key: index for index, key in enumerate(KEYS)}
 SCALE_STEPS = (2, 2, 1, 2, 2, 2, 1)
+PITCH_COUNT = len(PIPE_NOTATION) * len(FLAT_NOTE_ORDER)
 
-# Build Chromatic scales  programmatically
-CHROMATICS = {}
-CHROMATIC_INDEX = {}
+# Expressions with at least this many notes use the NumPy backed ArrayMusicExpression (when installed)
+ARRAY_EXPRESSION_MIN_NOTES = 1024
+# Most shifted rendering tables kept by shifted_table before the cache starts over
+SHIFTED_TABLE_CACHE_SIZE = 1024
 
 
-def build_chromatic_scales():
-    """Temporary function to build chromatic scales programmatically"""
-    for accidental, order in {'es': FLAT_NOTE_ORDER, 'is': SHARP_NOTE_ORDER}.items():
-        CHROMATICS[accidental] = {}
-        CHROMATIC_INDEX[accidental] = {}
-        index = 0
-        for octave in PIPE_NOTATION:
-            for note in order:
-                CHROMATICS[accidental][note + octave] = index
-                CHROMATIC_INDEX[accidental][index] = note + octave
-                index += 1
+# Pitch class of each natural note letter, and the half-steps an accidental ('es' flat, 'is' sharp) adds
+NATURAL_PITCH_CLASSES = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11}
+ACCIDENTAL_STEPS = {"es": -1, "": 0, "is": 1}
+ACCIDENTAL_SYMBOLS = {"es": "b", "": "", "is": "#"}
+OCTAVE = len(FLAT_NOTE_ORDER)
 
 
-build_chromatic_scales()
-del build_chromatic_scales
+def name_pitch_class(name: str) -> int:
+    """Pitch class (0 for c to 11 for b) of a note name: a letter and accidental, e.g. 'fis' or 'ces'"""
+    return (NATURAL_PITCH_CLASSES[name[0]] + ACCIDENTAL_STEPS[name[1:]]) % OCTAVE
 
 
-def get_major_scale(key, by_index: bool = False):
+def musical_name(name: str) -> str:
+    """Musical name of a note name, e.g. 'F#' for 'fis'"""
+    return name[0].upper() + ACCIDENTAL_SYMBOLS[name[1:]]
 
-    def index_generator(starting_note):
-        index = find_note_index(starting_note)
-        while True:
-            for steps in SCALE_STEPS:
-                yield index
-                index += steps
-
-    scale = SCALES[key]
-    notes = {}
-
-    # Handle first octave
-    octave = PIPE_NOTATION[0]
-    index_gen = index_generator(key + octave)
-    for letter in scale[scale.index(key):]:
-        if by_index:
-            notes[index_gen.__next__()] = letter + octave
-        else:
-            notes[letter + octave] = index_gen.__next__()
 
-    # Remaining octaves
-    for octave in PIPE_NOTATION[1:]:
-        for letter in scale:
-            if by_index:
-                notes[index_gen.__next__()] = letter + octave
-            else:
-                notes[letter + octave] = index_gen.__next__()
+class Pitch(int):
+    """Chromatic pitch: the number of half-steps above c,,, (the lowest note, 0)
+
+    Spelling is arithmetic. A note name gives the pitch class, and the octave mark is the octave of the name's
+    letter, so "eis'" is the pitch of "f'" and "ces'" the pitch of "b".
+    """
+
+    __slots__ = ()
+
+    @property
+    def octave(self) -> int:
+        return self // OCTAVE
+
+    @property
+    def pitch_class(self) -> int:
+        return self % OCTAVE
+
+    def spell(self, name: str) -> str:
+        """Notation of the pitch spelled with a note name of its pitch class"""
+        octave = (self - NATURAL_PITCH_CLASSES[name[0]] - ACCIDENTAL_STEPS[name[1:]]) // OCTAVE
+        if name_pitch_class(name) != self.pitch_class or not 0 <= octave < len(PIPE_NOTATION):
+            raise ValueError(f"Can't spell pitch {int(self)} as {name}")
+        return name + PIPE_NOTATION[octave]
+
+    def notation(self, scale: str = "es") -> str:
+        """Notation with the 'es' (flat) or 'is' (sharp) chromatic scale"""
+        return self.spell((FLAT_NOTE_ORDER if scale == "es" else SHARP_NOTE_ORDER)[self.pitch_class])
+
+    def scale_notation(self, key: str) -> str:
+        """Notation spelled using the major scale of key"""
+        return self.spell(get_scale_names(key)[self.pitch_class])
+
+
+def build_note_pitches() -> dict:
+    """Notation -> pitch for every letter, accidental and octave mark within the chromatic scale"""
+    note_pitches = {}
+    for octave, mark in enumerate(PIPE_NOTATION):
+        for letter, pitch_class in NATURAL_PITCH_CLASSES.items():
+            for accidental, steps in ACCIDENTAL_STEPS.items():
+                pitch = octave * OCTAVE + pitch_class + steps
+                if 0 <= pitch < PITCH_COUNT:
+                    note_pitches[letter + accidental + mark] = pitch
+    return note_pitches
+
+
+# Chromatic scales, computed once and read-only so they can be shared by concurrent transcriptions
+_chromatic_index = {
+    scale: {pitch: Pitch(pitch).notation(scale) for pitch in range(PITCH_COUNT)} for scale in ("es", "is")
+}
+_note_pitches = build_note_pitches()
+del build_note_pitches
+CHROMATICS = MappingProxyType(
+    {scale: MappingProxyType({notation: pitch for pitch, notation in notes.items()})
+     for scale, notes in _chromatic_index.items()}
+)
+CHROMATIC_INDEX = MappingProxyType({scale: MappingProxyType(notes) for scale, notes in _chromatic_index.items()})
+NOTE_PITCHES = MappingProxyType(_note_pitches)
+# Pitch of a note notation or None; the plain dict's get, twice as fast as going through the proxy
+note_pitch = _note_pitches.get
+
 
-    return notes
+def get_major_scale(key, by_index: bool = False):
+    """Notes of the major scale of key in every octave: notation -> pitch (pitch -> notation by_index)"""
+    scale = {}
+    for name in SCALES[key]:
+        for pitch in range(name_pitch_class(name), PITCH_COUNT, OCTAVE):
+            scale[pitch] = Pitch(pitch).spell(name)
+    if by_index:
+        return {pitch: scale[pitch] for pitch in sorted(scale)}
+    return {scale[pitch]: pitch for pitch in sorted(scale)}
 
 
 def find_note_indices(notation: str) -> list[int]:
-    indices = []
-    for note in notation.strip().split():
-        if note in CHROMATICS['es']:
-            indices.append(CHROMATICS['es'][note])
-        elif note in CHROMATICS['is']:
-            indices.append(CHROMATICS['is'][note])
-        else:
-            raise ValueError(f"Notation '{notation}' is invalid")
-    return indices
+    try:
+        return [_note_pitches[note] for note in notation.split()]
+    except KeyError:
+        raise ValueError(f"Notation '{notation}' is invalid") from None
 
 
 def find_note_index(notation: str) -> int:
@@ -96,6 +136,61 @@ def find_note_index(notation: str) -> int:
         raise ValueError(f"Notation '{notation}' is not valid")
     return values[0]
 
+
+# Immutable major scale tables (chromatic index -> notation) for every key, built once
+MAJOR_SCALES_BY_INDEX = {key: MappingProxyType(get_major_scale(key, by_index=True)) for key in KEYS}
+
+
+@lru_cache(maxsize=None)
+def get_scale_names(key: str) -> tuple[str]:
+    """Tuple of note names indexed by pitch class: the major scale of key, with the key's accidental for the
+    notes outside it"""
+    key_signature = KeySignature(key)
+    names = list(FLAT_NOTE_ORDER if key_signature.is_flat else SHARP_NOTE_ORDER)
+    for name in SCALES[key_signature.generic_name]:
+        names[name_pitch_class(name)] = name
+    return tuple(names)
+
+
+@lru_cache(maxsize=None)
+def get_notation_table(scale: str) -> tuple[str]:
+    """Tuple of note notation indexed by chromatic pitch for the 'es' or 'is' scale"""
+    return tuple(Pitch(pitch).notation(scale) for pitch in range(PITCH_COUNT))
+
+
+@lru_cache(maxsize=None)
+def get_scale_notation_table(key: str) -> tuple[str]:
+    """Tuple of note notation indexed by chromatic pitch, spelled using the major scale of key"""
+    names = get_scale_names(key)
+    return tuple(Pitch(pitch).spell(names[pitch % OCTAVE]) for pitch in range(PITCH_COUNT))
+
+
+@lru_cache(maxsize=None)
+def get_musical_name_table(key: str) -> tuple[str]:
+    """Tuple of musical note names (e.g. 'F#') indexed by chromatic pitch, spelled using the major scale of key"""
+    names = [musical_name(name) for name in get_scale_names(key)]
+    return tuple(names[pitch % OCTAVE] for pitch in range(PITCH_COUNT))
+
+
+# (id(table), steps) -> (table, shifted table); the table is kept alive so its id is not reused
+_shifted_tables = {}
+
+
+def shifted_table(table: (list, tuple), steps: int) -> tuple:
+    """Returns a rendering table indexed by pitch before a transposition of steps: shifted[p] is table[p + steps]
+
+    Rendering untransposed pitches through it renders them transposed, without adding steps to each note.
+    Entries that would fall outside table are None (a range checked transposition never reads them).
+    """
+    cached = _shifted_tables.get((id(table), steps))
+    if cached is None or cached[0] is not table:
+        if len(_shifted_tables) >= SHIFTED_TABLE_CACHE_SIZE:
+            _shifted_tables.clear()
+        shifted = tuple(table[steps:]) if steps >= 0 else (None,) * -steps + tuple(table)
+        cached = _shifted_tables[(id(table), steps)] = (table, shifted)
+    return cached[1]
+
+
 def get_key_from_control_string(control_string: str):
 
     if not (match := re.search(r"^\s*(\S+)\s+\\(\S+)", control_string)):
@@ -142,29 +237,48 @@ class NoteParser:
 
 
 class KeySignature:
-
-    def __init__(self, notation: str):
-        self._note_parser = NoteParser(notation)
-        self.scale_by_index = get_major_scale(notation, by_index=True)
-        if self._note_parser.generic_name not in KEYS:
+    """Immutable major key signature
+
+    Instances are interned: constructing the same key again returns the existing object, so creating a
+    KeySignature in a hot loop is a dict lookup.
+    """
+
+    _interned = {}
+
+    def __new__(cls, notation: str):
+        key_signature = cls._interned.get(notation)
+        if key_signature is None:
+            key_signature = super().__new__(cls)
+            key_signature._load(notation)
+            # setdefault keeps the first of two threads interning the same key
+            key_signature = cls._interned.setdefault(notation, key_signature)
+        return key_signature
+
+    def _load(self, notation: str):
+        note_parser = NoteParser(notation)
+        generic_name = note_parser.generic_name
+        if generic_name not in KEY_INDEX or note_parser.octave or note_parser.value:
             raise ValueError(f"Unsupported key signature {notation}. must be one of {KEYS}")
+        object.__setattr__(self, "_note_parser", note_parser)
+        object.__setattr__(self, "_index", KEY_INDEX[generic_name])
+        object.__setattr__(self, "_is_flat", note_parser.accidental == "es"
+                           or (note_parser.letter == "f" and note_parser.accidental == ""))
+        object.__setattr__(self, "scale_by_index", MAJOR_SCALES_BY_INDEX[generic_name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return KeySignature, (self.notation,)
 
     @property
     def key(self):
         """Gets the key in notation format"""
         return self.chromatic_index[self.index]
 
-    @key.setter
-    def key(self, notation):
-        """Sets the key in notation format"""
-        self._note_parser = NoteParser(notation)
-
     @property
     def index(self) -> int:
-        try:
-            return KEYS.index(self._note_parser.generic_name)
-        except ValueError:
-            raise ValueError(f"Key index not found in {KEYS}") from None
+        return self._index
 
     @property
     def name(self):
@@ -174,12 +288,13 @@ class KeySignature:
     def notation(self):
         return self._note_parser.notation
 
+    @property
+    def generic_name(self) -> str:
+        return self._note_parser.generic_name
+
     @property
     def is_flat(self) -> bool:
-        if self._note_parser.accidental == "es" \
-                or (self._note_parser.letter == "f" and self._note_parser.accidental == ""):
-            return True
-        return False
+        return self._is_flat
 
     @property
     def is_sharp(self) -> bool:
@@ -205,7 +320,10 @@ class KeySignature:
         return find_note_index(notation)
 
     def get_scale_notation(self, index: int):
-        return self.scale_by_index.get(index, self.get_note_notation(index))
+        """Returns the notation of a note spelled using the major scale of the key"""
+        if not 0 <= index < PITCH_COUNT:
+            raise ValueError(f"Invalid index {index}")
+        return self.scale_notation_table[index]
 
     def get_note_notation(self, index: int):
         """Returns the notation of a note from the chromatic scale"""
@@ -214,6 +332,14 @@ class KeySignature:
         except KeyError:
             raise ValueError(f"Invalid index {index}") from None
 
+    @property
+    def notation_table(self) -> tuple[str]:
+        return get_notation_table(self.scale)
+
+    @property
+    def scale_notation_table(self) -> tuple[str]:
+        return get_scale_notation_table(self.notation)
+
     def get_transposition_half_steps(self, to_key, direction: (None, str) = None):
 
         new_key = KeySignature(to_key)
@@ -257,26 +383,83 @@ class KeySignature:
         return self.name
 
 
+def check_transposition(pitch_range: (None, tuple[int, int]), steps: int):
+    """Raises ValueError if a transposition by steps moves the (lowest, highest) pitch off the chromatic scale"""
+    if pitch_range is not None and not (0 <= pitch_range[0] + steps and pitch_range[1] + steps < PITCH_COUNT):
+        raise ValueError("Transposition is out of range")
+
+
 class MusicExpression:
 
     def __init__(self, notation: str, key: str):
         self.logger = logging.getLogger(__name__)
         self._key: KeySignature = KeySignature(key)
-        self._notes: list[int] = find_note_indices(notation)
+        self._notes = self.load_pitches(find_note_indices(notation))
+        self._range = self.find_range(self._notes)
         self.logger.debug(f"loaded notation='{notation}', key={key}")
 
+    @classmethod
+    def from_pitches(cls, pitches, key: str):
+        """Creates an expression from a sequence of chromatic pitches (skips parsing notation)"""
+        expression = cls.__new__(cls)
+        expression.logger = logging.getLogger(__name__)
+        expression._key = KeySignature(key)
+        expression._notes = expression.load_pitches(pitches)
+        expression._range = expression.find_range(expression._notes)
+        expression.check_range(0)
+        return expression
+
+    def load_pitches(self, pitches):
+        """Converts a sequence of chromatic pitches to the internal note storage"""
+        return list(pitches)
+
+    @staticmethod
+    def find_range(notes) -> (None, tuple[int, int]):
+        """(lowest, highest) pitch of the note storage, None when empty"""
+        if not len(notes):
+            return None
+        return int(min(notes)), int(max(notes))
+
+    @property
+    def pitch_range(self) -> (None, tuple[int, int]):
+        """(lowest, highest) pitch, None when there are no notes (kept up to date, never rescanned)"""
+        return self._range
+
+    def check_range(self, steps: int):
+        """Raises ValueError if any note transposed by steps falls outside the chromatic scale"""
+        check_transposition(self._range, steps)
+
     def transpose_half_steps(self, steps):
+        """Transposes every note, or none of them (raising ValueError) if any would fall out of range"""
         self.logger.debug(f"transposing half-steps={steps}")
-        for index in range(len(self._notes)):
-            self._notes[index] += steps
-            if self._notes[index] < 0 or self._notes[index] not in self._key.chromatic_index:
-                raise ValueError("Transposition is out of range")
+        self.check_range(steps)
+        if steps == 0 or self._range is None:
+            return
+        # A new list rather than in place: TransposedViews of this expression keep the notes they were made from
+        self._notes = [note + steps for note in self._notes]
+        self._range = (self._range[0] + steps, self._range[1] + steps)
 
     def transpose_to_key(self, key: str, direction: (None, str) = None):
         self.logger.debug(f"transposing key from {self.key} to {key}")
         self.transpose_half_steps(self._key.get_transposition_half_steps(key, direction))
         self._key = KeySignature(key)
 
+    def transposed(self, steps: int = 0) -> "TransposedView":
+        """Immutable view of the notes transposed by steps (checked at once; nothing is copied)"""
+        return TransposedView(self._notes, self._range, self._key, steps, self.render_notes)
+
+    def transposed_to_key(self, key: str, direction: (None, str) = None) -> "TransposedView":
+        """Immutable view of the notes transposed to key (checked at once; nothing is copied)"""
+        return self.transposed().transpose_to_key(key, direction)
+
+    @staticmethod
+    def render_notes(notes, table: (list, tuple)) -> list:
+        return [table[n] for n in notes]
+
+    def render(self, table: (list, tuple)) -> list:
+        """List of table values indexed by each note (e.g. a notation table or Harmonica.tab_index)"""
+        return self.render_notes(self._notes, table)
+
     @property
     def key(self):
         return self._key.key
@@ -286,11 +469,108 @@ class MusicExpression:
         """notation as a single string"""
         return " ".join(self.notation_list)
 
+    @property
+    def pitches(self) -> tuple[int]:
+        """Tuple of integers - each note as an index of the chromatic scale"""
+        return tuple(self._notes)
+
     @property
     def notation_list(self) -> list[str]:
         """List of strings - each note in notation form"""
-        return [self._key.chromatic_index[n] for n in self._notes]
+        return self.render(self._key.notation_table)
 
     @property
     def scale_notation_list(self) -> list[str]:
-        return [self._key.get_scale_notation(index) for index in self._notes]
+        return self.render(self._key.scale_notation_table)
+
+
+class TransposedView:
+    """Immutable transposition of a MusicExpression's notes
+
+    The notes are shared, not copied: transposing a view only changes its offset, checked in O(1) against
+    the expression's lowest and highest pitch, and the offset is applied when rendering by indexing a shifted
+    table (see shifted_table). Any number of transpositions of one song cost no copies of its notes.
+    """
+
+    __slots__ = ("_notes", "_range", "_key", "_steps", "_render_notes")
+
+    def __init__(self, notes, pitch_range: (None, tuple[int, int]), key: KeySignature, steps: int, render_notes):
+        check_transposition(pitch_range, steps)
+        object.__setattr__(self, "_notes", notes)
+        object.__setattr__(self, "_range", pitch_range)
+        object.__setattr__(self, "_key", key)
+        object.__setattr__(self, "_steps", steps)
+        object.__setattr__(self, "_render_notes", render_notes)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __len__(self) -> int:
+        return len(self._notes)
+
+    @property
+    def steps(self) -> int:
+        """Half-steps from the expression the view was made from"""
+        return self._steps
+
+    @property
+    def key(self):
+        return self._key.key
+
+    @property
+    def pitch_range(self) -> (None, tuple[int, int]):
+        if self._range is None:
+            return None
+        return self._range[0] + self._steps, self._range[1] + self._steps
+
+    def transpose_half_steps(self, steps: int) -> "TransposedView":
+        """New view transposed a further steps (ValueError if any note would fall out of range)"""
+        return TransposedView(self._notes, self._range, self._key, self._steps + steps, self._render_notes)
+
+    def transpose_to_key(self, key: str, direction: (None, str) = None) -> "TransposedView":
+        """New view transposed to key"""
+        steps = self._steps + self._key.get_transposition_half_steps(key, direction)
+        return TransposedView(self._notes, self._range, KeySignature(key), steps, self._render_notes)
+
+    def render(self, table: (list, tuple)) -> list:
+        """List of table values indexed by each transposed note"""
+        if self._steps == 0:
+            return self._render_notes(self._notes, table)
+        return self._render_notes(self._notes, shifted_table(table, self._steps))
+
+    @property
+    def pitches(self) -> tuple[int]:
+        """Tuple of the transposed chromatic pitches (a copy)"""
+        return tuple(int(note) + self._steps for note in self._notes)
+
+    @property
+    def notation(self) -> str:
+        return " ".join(self.notation_list)
+
+    @property
+    def notation_list(self) -> list[str]:
+        return self.render(self._key.notation_table)
+
+    @property
+    def scale_notation_list(self) -> list[str]:
+        return self.render(self._key.scale_notation_table)
+
+
+_array_expression_class = None
+
+
+def expression_class(note_count: int = 0):
+    """Returns the MusicExpression class suited to the number of notes
+
+    Long expressions use ArrayMusicExpression when NumPy is installed, otherwise MusicExpression.
+    """
+    global _array_expression_class
+    if note_count < ARRAY_EXPRESSION_MIN_NOTES:
+        return MusicExpression
+    if _array_expression_class is None:
+        try:
+            from harp_helper.music_array import ArrayMusicExpression
+            _array_expression_class = ArrayMusicExpression
+        except ImportError:
+            _array_expression_class = MusicExpression
+    return _array_expression_class
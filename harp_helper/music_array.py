@@ -0,0 +1,79 @@
+"""
+music_array.py - NumPy backed music expressions for very long note sequences
+
+Requires the optional NumPy dependency (pip install harp-helper[fast]).
+"""
+import numpy
+
+from harp_helper import music
+
+PITCH_DTYPE = numpy.int16
+
+# NumPy object arrays of rendering tables, keyed by id() (the table is kept alive alongside its array, so
+# its id is not reused while cached). Cleared when full, like music's shifted tables: those are rebuilt as new
+# tables once their cache is cleared, so arrays of the old ones would otherwise pile up.
+TABLE_ARRAY_CACHE_SIZE = music.SHIFTED_TABLE_CACHE_SIZE
+_table_arrays = {}
+
+
+def get_table_array(table: (list, tuple)) -> numpy.ndarray:
+    """Returns a NumPy object array of a rendering table for fancy indexing"""
+    cached = _table_arrays.get(id(table))
+    if cached is None or cached[0] is not table:
+        if len(_table_arrays) >= TABLE_ARRAY_CACHE_SIZE:
+            _table_arrays.clear()
+        # Filled item by item so that tuple values (e.g. Harmonica.hole_index) stay single objects
+        array = numpy.empty(len(table), dtype=object)
+        for index, value in enumerate(table):
+            array[index] = value
+        cached = _table_arrays[id(table)] = (table, array)
+    return cached[1]
+
+
+class ArrayMusicExpression(music.MusicExpression):
+    """MusicExpression with notes stored in a NumPy int16 array
+
+    Transposition and rendering are whole-array operations. A transposition that would fall out of range
+    raises ValueError without modifying any notes.
+    """
+
+    _shared = False
+
+    def load_pitches(self, pitches):
+        return numpy.array(pitches, dtype=PITCH_DTYPE)
+
+    @staticmethod
+    def find_range(notes) -> (None, tuple[int, int]):
+        if len(notes) == 0:
+            return None
+        return int(notes.min()), int(notes.max())
+
+    def transpose_half_steps(self, steps):
+        self.logger.debug(f"transposing half-steps={steps}")
+        self.check_range(steps)
+        if steps == 0 or self._range is None:
+            return
+        if self._shared:
+            # Views hold the current array: transpose a copy
+            self._notes = self._notes + PITCH_DTYPE(steps)
+            self._shared = False
+        else:
+            self._notes += steps
+        self._range = (self._range[0] + steps, self._range[1] + steps)
+
+    def transposed(self, steps: int = 0) -> music.TransposedView:
+        self._shared = True
+        return super().transposed(steps)
+
+    @staticmethod
+    def render_notes(notes, table: (list, tuple)) -> list:
+        return get_table_array(table)[notes].tolist()
+
+    @property
+    def pitches(self) -> numpy.ndarray:
+        """Read-only NumPy array of the chromatic pitch of each note (not changed by a later transposition)"""
+        # The view holds the current array: make the next transposition copy it
+        self._shared = True
+        pitches = self._notes.view()
+        pitches.flags.writeable = False
+        return pitches
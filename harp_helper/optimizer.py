@@ -0,0 +1,122 @@
+"""
+optimizer.py - Choice of one hole per note where a pitch can be played on several holes
+
+Each note has a tuple of candidate Holes (Harmonica.hole_index). The optimizer finds the path through these
+candidates with the lowest total cost of moving between holes and changing breath (blow/draw) or slide, with
+a Viterbi style dynamic program: one step per note, comparing each candidate with each candidate of the
+previous note.
+
+Decisions are streamed. Whenever a note has a single candidate every path goes through it, so the notes
+before it are decided and yielded. Undecided notes are also forced out after 'window' notes, which bounds
+memory on songs (or lines) of any length. Unplayable notes (no candidates) yield None and the path carries on
+from the hole played before them.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+UNPLAYABLE = "X"
+DEFAULT_WINDOW = 1024
+MOVE_COST = 1
+BREATH_COST = 1
+SLIDE_COST = 2
+
+
+class HolePathOptimizer:
+    """Streaming lowest cost hole path solver
+
+    The last hole chosen is kept between calls, so phrases of a song can be passed one at a time and the
+    first note of a phrase still takes the previous phrase into account.
+    """
+
+    def __init__(self,
+                 window: int = DEFAULT_WINDOW,
+                 move_cost: int = MOVE_COST,
+                 breath_cost: int = BREATH_COST,
+                 slide_cost: int = SLIDE_COST):
+        if window < 1:
+            raise ValueError(f"window must be at least 1, not {window}")
+        self.window = window
+        self.move_cost = move_cost
+        self.breath_cost = breath_cost
+        self.slide_cost = slide_cost
+        self.previous = None
+
+    def transition_cost(self, hole, next_hole) -> int:
+        """Cost of playing next_hole right after hole"""
+        cost = self.move_cost * abs(hole.number - next_hole.number)
+        if hole.breath != next_hole.breath:
+            cost += self.breath_cost
+        if hole.slide != next_hole.slide:
+            cost += self.slide_cost
+        return cost
+
+    def path(self, candidates_by_note):
+        """Generator for yielding the chosen Hole (None when unplayable) for each tuple of candidate holes"""
+        transition_cost = self.transition_cost
+        window = self.window
+        # (candidates, back pointers) of each undecided note, the candidates of the last playable one and the best
+        # path cost to each of them
+        pending = []
+        prior_candidates = ()
+        costs = []
+        for candidates in candidates_by_note:
+            if not candidates:
+                # Unplayable notes are skipped over: the path continues from the hole before them
+                if not pending:
+                    yield None
+                    continue
+                pending.append((candidates, None))
+                if len(pending) >= window:
+                    yield from self.decide(pending, costs)
+                    pending = []
+                continue
+
+            if not pending:
+                previous = self.previous
+                costs = [0 if previous is None else transition_cost(previous, hole) for hole in candidates]
+                back_pointers = None
+            else:
+                prior_costs = costs
+                costs = []
+                back_pointers = []
+                for hole in candidates:
+                    best_cost = None
+                    best_state = 0
+                    for state, prior in enumerate(prior_candidates):
+                        cost = prior_costs[state] + transition_cost(prior, hole)
+                        if best_cost is None or cost < best_cost:
+                            best_cost = cost
+                            best_state = state
+                    costs.append(best_cost)
+                    back_pointers.append(best_state)
+            prior_candidates = candidates
+            pending.append((candidates, back_pointers))
+
+            if len(candidates) == 1 or len(pending) >= window:
+                yield from self.decide(pending, costs)
+                pending = []
+
+        if pending:
+            yield from self.decide(pending, costs)
+
+    def decide(self, pending: list, costs: list) -> list:
+        """Returns the holes of the lowest cost path through the pending notes (and remembers the last hole)"""
+        state = costs.index(min(costs))
+        holes = [None] * len(pending)
+        previous = None
+        for position in range(len(pending) - 1, -1, -1):
+            candidates, back_pointers = pending[position]
+            if not candidates:
+                continue
+            holes[position] = candidates[state]
+            if previous is None:
+                previous = holes[position]
+            if back_pointers is not None:
+                state = back_pointers[state]
+        self.previous = previous
+        return holes
+
+    def render(self, candidates_by_note) -> list[str]:
+        """List of the tab notation of the chosen hole for each tuple of candidate holes"""
+        return [UNPLAYABLE if hole is None else hole.notation for hole in self.path(candidates_by_note)]
@@ -0,0 +1,168 @@
+"""
+search.py - Ranking of harmonica types, keys and transpositions for a song
+
+A song is reduced to a histogram of pitches (one per source key, since phrases in a \\key are transposed to
+the harmonica key). Each candidate harmonica type and key is a playable mask and a range mask over the
+chromatic pitches, so the score of every candidate and transposition is a histogram x shifted mask product
+instead of a re-transcription. NumPy (pip install harp-helper[fast]) computes them all in one operation;
+without it the same sums are taken over the pitches that occur in the song.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+import logging
+
+from harp_helper.harps import get_harmonica_class, Harmonica, LAYOUT_CACHE_SIZE
+from harp_helper import music
+
+logger = logging.getLogger(__name__)
+
+# Default transpositions tried: the song as written and up to two octaves up or down
+OCTAVE_STEPS = (0, -12, 12, -24, 24)
+
+
+@dataclass
+class KeyScore:
+    harmonica_type: str
+    harmonica_key: str
+    transpose_steps: int
+    notes: int
+    unplayable: int
+    out_of_range: int
+
+    @property
+    def playable(self) -> int:
+        return self.notes - self.unplayable
+
+    def rank_key(self) -> tuple:
+        return self.unplayable, self.out_of_range, abs(self.transpose_steps), self.transpose_steps < 0
+
+
+def pitch_histograms(phrases) -> dict:
+    """Returns {source key (None for the harmonica key): list of note counts by chromatic pitch}"""
+    counters = {}
+    for phrase in phrases:
+        counter = counters.get(phrase.key)
+        if counter is None:
+            counter = counters[phrase.key] = Counter()
+        counter.update(phrase.pitches)
+    histograms = {}
+    for key, counter in counters.items():
+        histogram = [0] * music.PITCH_COUNT
+        for pitch, count in counter.items():
+            histogram[pitch] = count
+        histograms[key] = histogram
+    return histograms
+
+
+def available_keys(harmonica_type: str, keys=music.KEYS) -> list[str]:
+    """The keys (in the order of keys) harmonicas of harmonica_type are made in (Harmonica.keys_available)"""
+    offered = get_harmonica_class(harmonica_type).keys_available
+    return [key for key in keys if key in offered]
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def harp_masks(harmonica_type: str, key: str) -> tuple[tuple[int], tuple[int]]:
+    """Returns the (playable, in range) 0/1 masks of a harmonica by chromatic pitch"""
+    harp = Harmonica(harmonica_type, key)
+    playable = tuple(0 if tab == "X" else 1 for tab in harp.tab_index)
+    lowest = music.find_note_index(harp.lowest_note)
+    highest = music.find_note_index(harp.highest_note)
+    in_range = tuple(1 if lowest <= pitch <= highest else 0 for pitch in range(music.PITCH_COUNT))
+    return playable, in_range
+
+
+def key_shift(source_key: (None, str), harmonica_key: str, direction: str) -> int:
+    """Half-steps engine.transcribe moves notes in source_key to play them on a harmonica in harmonica_key"""
+    if source_key is None or source_key == harmonica_key:
+        return 0
+    return music.KeySignature(source_key).get_transposition_half_steps(harmonica_key, direction)
+
+
+def rank_harps(histograms: dict,
+               harmonica_types=None,
+               keys=music.KEYS,
+               transpose_steps=OCTAVE_STEPS,
+               direction: str = "closest") -> list[KeyScore]:
+    """Scores every harmonica type x available key x transposition for a song's pitch_histograms, best first
+
+    Candidates are ranked by unplayable notes, then notes outside the harmonica's lowest/highest note, then
+    the smallest transposition. A result is used with "harp tab -t TYPE -k KEY -n STEPS" (no source key).
+    """
+    if harmonica_types is None:
+        harmonica_types = list(Harmonica.types())
+    if not histograms:
+        histograms = {None: [0] * music.PITCH_COUNT}
+    candidates = [(harmonica_type, key) for harmonica_type in harmonica_types
+                  for key in available_keys(harmonica_type, keys)]
+    transpose_steps = list(transpose_steps)
+    masks = [harp_masks(harmonica_type, key) for harmonica_type, key in candidates]
+    shifts = [[key_shift(source_key, key, direction) for source_key in histograms] for _, key in candidates]
+
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    if numpy is not None:
+        unplayable, out_of_range = score_arrays(numpy, histograms, masks, shifts, transpose_steps)
+    else:
+        unplayable, out_of_range = score_lists(histograms, masks, shifts, transpose_steps)
+
+    notes = sum(sum(histogram) for histogram in histograms.values())
+    scores = [
+        KeyScore(harmonica_type, key, steps, notes, unplayable[c][s], out_of_range[c][s])
+        for c, (harmonica_type, key) in enumerate(candidates)
+        for s, steps in enumerate(transpose_steps)
+    ]
+    scores.sort(key=KeyScore.rank_key)
+    return scores
+
+
+def score_lists(histograms: dict, masks: list, shifts: list, transpose_steps: list) -> tuple[list, list]:
+    """Pure Python scoring: sums over the pitches that occur in the song"""
+    used = [[(pitch, count) for pitch, count in enumerate(histogram) if count] for histogram in histograms.values()]
+    unplayable = []
+    out_of_range = []
+    for (playable, in_range), key_shifts in zip(masks, shifts):
+        unplayable_row = []
+        out_of_range_row = []
+        for steps in transpose_steps:
+            missing = 0
+            outside = 0
+            for pitches, shift in zip(used, key_shifts):
+                for pitch, count in pitches:
+                    moved = pitch + steps + shift
+                    if not 0 <= moved < music.PITCH_COUNT:
+                        missing += count
+                        outside += count
+                        continue
+                    if not playable[moved]:
+                        missing += count
+                    if not in_range[moved]:
+                        outside += count
+            unplayable_row.append(missing)
+            out_of_range_row.append(outside)
+        unplayable.append(unplayable_row)
+        out_of_range.append(out_of_range_row)
+    return unplayable, out_of_range
+
+
+def score_arrays(numpy, histograms: dict, masks: list, shifts: list, transpose_steps: list) -> tuple[list, list]:
+    """NumPy scoring: one gather of the shifted masks and one product with the histograms"""
+    pad = max([abs(steps) for steps in transpose_steps] + [0]) + len(music.KEYS)
+    # candidate x pitch masks, padded so shifted pitches off either end read 0 (unplayable and out of range)
+    playable = numpy.zeros((len(masks), music.PITCH_COUNT + 2 * pad), dtype=numpy.int64)
+    in_range = numpy.zeros_like(playable)
+    for c, (playable_mask, in_range_mask) in enumerate(masks):
+        playable[c, pad:pad + music.PITCH_COUNT] = playable_mask
+        in_range[c, pad:pad + music.PITCH_COUNT] = in_range_mask
+
+    histogram = numpy.array(list(histograms.values()), dtype=numpy.int64)  # source key x pitch
+    # candidate x step x source key x pitch indexes into the padded masks
+    offsets = (numpy.array(transpose_steps)[None, :, None] + numpy.array(shifts)[:, None, :] + pad)
+    index = offsets[..., None] + numpy.arange(music.PITCH_COUNT)
+    rows = numpy.arange(len(masks))[:, None, None, None]
+    notes = histogram.sum()
+    unplayable = notes - numpy.einsum("cskp,kp->cs", playable[rows, index], histogram)
+    out_of_range = notes - numpy.einsum("cskp,kp->cs", in_range[rows, index], histogram)
+    return unplayable.tolist(), out_of_range.tolist()
@@ -0,0 +1,352 @@
+"""
+server.py - Local HTTP/JSON transcription service ("harp serve")
+
+    POST /tab      {"notation": "c' d' e'", "harmonica_type": "d10s", "harmonica_key": "c", "source_key": null,
+                    "transpose_steps": 0, "direction": "closest", "best_holes": false}
+                   -> {"tabs": [["4", "-4", "5"]], "notes": 3, "unplayable": 0}
+    GET  /metrics  -> request, batch, latency and throughput counters
+
+Only "notation" is required; the other fields default as on the command line. Requests are micro-batched:
+the batcher waits batch_window seconds after a request arrives for others to join it (up to max_batch), then
+transcribes the whole batch in one call on the transcription thread, so a burst of small requests costs one
+thread hand-off rather than one each. The event loop only parses HTTP and JSON. Harmonicas are built once per
+type and key and shared by every request; their indexes, the key signatures and the music tables are
+immutable, so nothing a request touches is written by another.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from http import HTTPStatus
+import json
+import logging
+import time
+
+from harp_helper import engine
+from harp_helper.harps import Harmonica, LAYOUT_CACHE_SIZE
+from harp_helper.optimizer import UNPLAYABLE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_BATCH_WINDOW = 0.002
+DEFAULT_MAX_BATCH = 64
+MAX_BODY_SIZE = 1 << 24
+# Recent request latencies kept for the percentiles in /metrics
+LATENCY_SAMPLES = 10_000
+
+# JSON field -> (type, default) of a /tab request
+TAB_FIELDS = {
+    "notation": (str, None),
+    "harmonica_type": (str, "d10s"),
+    "harmonica_key": (str, "c"),
+    "source_key": ((str, type(None)), None),
+    "transpose_steps": (int, 0),
+    "direction": (str, "closest"),
+    "best_holes": (bool, False)
+}
+DIRECTIONS = ("closest", "up", "down")
+
+
+class RequestError(ValueError):
+    """Bad request: reported to the client with a 4xx status"""
+
+    def __init__(self, message: str, status: HTTPStatus = HTTPStatus.BAD_REQUEST):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class Metrics:
+    requests: int = 0
+    errors: int = 0
+    batches: int = 0
+    notes: int = 0
+    started: float = field(default_factory=time.monotonic)
+    latencies: deque = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def record(self, seconds: float, notes: int = 0, error: bool = False):
+        self.requests += 1
+        self.notes += notes
+        if error:
+            self.errors += 1
+        self.latencies.append(seconds)
+
+    def as_dict(self) -> dict:
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 3)
+
+        return {
+            "uptime_seconds": round(uptime, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "notes": self.notes,
+            "requests_per_second": round(self.requests / uptime, 2) if uptime else 0.0,
+            "notes_per_second": round(self.notes / uptime, 2) if uptime else 0.0,
+            "latency_ms": {
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "p99": percentile(0.99),
+                "max": percentile(1.0)
+            }
+        }
+
+
+@lru_cache(maxsize=LAYOUT_CACHE_SIZE)
+def get_harmonica(harmonica_type: str, harmonica_key: str) -> Harmonica:
+    """Shared Harmonica for a type and key (built once, read only afterwards)"""
+    return Harmonica(harmonica_type=harmonica_type, harmonica_key=harmonica_key)
+
+
+def parse_tab_request(payload) -> dict:
+    """Returns the transcription options of a /tab request body, with defaults filled in"""
+    if not isinstance(payload, dict):
+        raise RequestError("Request body must be a JSON object")
+    unknown = set(payload) - set(TAB_FIELDS)
+    if unknown:
+        raise RequestError(f"Unknown fields {sorted(unknown)}")
+    options = {}
+    for name, (field_type, default) in TAB_FIELDS.items():
+        value = payload.get(name, default)
+        # bool is an int, but not a number of half-steps
+        if not isinstance(value, field_type) or (field_type is int and isinstance(value, bool)):
+            raise RequestError(f"Field '{name}' is missing or has the wrong type")
+        options[name] = value
+    if options["direction"] not in DIRECTIONS:
+        raise RequestError(f"Field 'direction' must be one of {DIRECTIONS}")
+    return options
+
+
+def transcribe_request(notation: str,
+                       harmonica_type: str,
+                       harmonica_key: str,
+                       source_key: (None, str),
+                       transpose_steps: int,
+                       direction: str,
+                       best_holes: bool) -> dict:
+    """Transcribes one /tab request, returning the response body"""
+    tabs = list(engine.transcribe(
+        engine.generate_phrases(notation.splitlines()),
+        get_harmonica(harmonica_type, harmonica_key),
+        source_key=source_key,
+        transpose_steps=transpose_steps,
+        direction=direction,
+        optimize=best_holes
+    ))
+    return {
+        "tabs": tabs,
+        "notes": sum(len(phrase) for phrase in tabs),
+        "unplayable": sum(phrase.count(UNPLAYABLE) for phrase in tabs)
+    }
+
+
+def transcribe_batch(batch: list[dict]) -> list:
+    """Transcribes a batch of request options, returning a response body or the exception for each
+
+    A request that fails only fails itself, not the requests batched with it.
+    """
+    results = []
+    for options in batch:
+        try:
+            results.append(transcribe_request(**options))
+        except (ValueError, NotImplementedError) as e:
+            results.append(e)
+        except Exception as e:
+            logger.exception("request failed")
+            results.append(e)
+    return results
+
+
+def warm_harmonicas():
+    """Builds the tab index of every harmonica type and key ahead of the first request"""
+    for harmonica_type in Harmonica.types():
+        for key in get_harmonica(harmonica_type, "c").keys_available:
+            try:
+                get_harmonica(harmonica_type, key).tab_index
+            except ValueError:
+                logger.debug(f"{harmonica_type}: skipping unsupported key {key}")
+
+
+class TabServer:
+    """asyncio HTTP/JSON server batching /tab requests onto one transcription thread"""
+
+    def __init__(self,
+                 host: str = DEFAULT_HOST,
+                 port: int = DEFAULT_PORT,
+                 batch_window: float = DEFAULT_BATCH_WINDOW,
+                 max_batch: int = DEFAULT_MAX_BATCH):
+        if max_batch < 1:
+            raise ValueError(f"max_batch must be at least 1, not {max_batch}")
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.metrics = Metrics()
+        self._queue = None
+        self._server = None
+        self._batcher = None
+        # One thread: transcription holds the GIL, so more threads would only take turns
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="harp-tab")
+
+    async def start(self):
+        """Warms the harmonica indexes and starts listening (port 0 picks a free port, stored in self.port)"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, warm_harmonicas)
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self.run_batches())
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"listening on http://{self.host}:{self.port}")
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._batcher is not None:
+            self._batcher.cancel()
+            self._batcher = None
+        self._executor.shutdown(wait=False)
+
+    # \\\\\\\ Batching ///////
+
+    async def submit(self, options: dict) -> dict:
+        """Queues a request for the next batch and waits for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((options, future))
+        result = await future
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_window > 0 and self._queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.batch_window)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self.metrics.batches += 1
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, transcribe_batch, [options for options, _ in batch]
+                )
+            except Exception as e:
+                logger.exception("batch failed")
+                results = [e] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    # \\\\\\\ HTTP ///////
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> tuple[HTTPStatus, dict]:
+        """Returns the (status, JSON body) response to a request"""
+        expected_method = {"/tab": "POST", "/metrics": "GET"}.get(path)
+        if expected_method is None:
+            return HTTPStatus.NOT_FOUND, {"error": f"Unknown path {path}"}
+        if method != expected_method:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} not allowed on {path}"}
+        if path == "/metrics":
+            return HTTPStatus.OK, self.metrics.as_dict()
+
+        start = time.perf_counter()
+        try:
+            try:
+                payload = json.loads(body)
+            except ValueError as e:
+                raise RequestError(f"Request body is not valid JSON: {e}") from None
+            result = await self.submit(parse_tab_request(payload))
+        except (ValueError, NotImplementedError) as e:
+            self.metrics.record(time.perf_counter() - start, error=True)
+            return getattr(e, "status", HTTPStatus.BAD_REQUEST), {"error": str(e)}
+        except Exception as e:
+            # Logged where it was raised
+            self.metrics.record(time.perf_counter() - start, error=True)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"Internal error: {e}"}
+        self.metrics.record(time.perf_counter() - start, notes=result["notes"])
+        return HTTPStatus.OK, result
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves HTTP/1.1 requests on one connection (kept alive unless the client asks to close it)"""
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                    if not request_line.strip():
+                        break
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if not line.strip():
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                except (ValueError, asyncio.LimitOverrunError):
+                    # A line longer than the stream limit
+                    self.write_response(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                        {"error": "Request line or header is too large"}, False)
+                    break
+
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    self.write_response(writer, HTTPStatus.BAD_REQUEST, {"error": "Malformed request"}, False)
+                    break
+                if not 0 <= length <= MAX_BODY_SIZE:
+                    self.write_response(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                        {"error": "Request body is too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, payload = await self.dispatch(method, path.partition("?")[0], body)
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def write_response(writer: asyncio.StreamWriter, status: HTTPStatus, payload: dict, keep_alive: bool):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            f"\r\n".encode("latin-1") + body
+        )
+
+
+def serve(host: str = DEFAULT_HOST,
+          port: int = DEFAULT_PORT,
+          batch_window: float = DEFAULT_BATCH_WINDOW,
+          max_batch: int = DEFAULT_MAX_BATCH):
+    """Runs a TabServer until interrupted"""
+    server = TabServer(host, port, batch_window, max_batch)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        logger.info("stopped")
@@ -0,0 +1,212 @@
+"""
+songfile.py - Compact binary song files: parsed phrases that reload without parsing
+
+Layout (little-endian, each array starting on an 8 byte boundary):
+
+    header        magic b"HARPSONG", version (uint16), flags (uint16), phrase count (uint32),
+                  pitch count (uint64), key table size in bytes (uint32)
+    key table     the source keys used by \\key commands, UTF-8, separated by newlines
+    starts        uint64[phrase count + 1]  offset of each phrase's first pitch (plus the end offset)
+    lines         uint32[phrase count]      source line of each phrase
+    keys          uint16[phrase count]      index into the key table (NO_KEY before any \\key command)
+    pitches       uint8[pitch count]        chromatic pitch of every note, phrase after phrase
+
+SongFile maps the file read-only and hands out memoryview slices, so nothing is copied until a phrase is
+transcribed and worker processes reading the same file share its pages through the OS page cache.
+"""
+from array import array
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from harp_helper import music
+from harp_helper.tokenizer import Phrase
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"HARPSONG"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQI")
+ALIGNMENT = 8
+NO_KEY = 0xFFFF
+SONG_FILE_EXTENSION = ".hsong"
+NOTATION_FILE_EXTENSION = ".ly"
+
+
+def is_song_file(file_name: str) -> bool:
+    """True if file_name starts with the song file magic"""
+    try:
+        with open(file_name, "rb") as fh:
+            return fh.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def padding(offset: int) -> int:
+    return -offset % ALIGNMENT
+
+
+def write_song(phrases, file_name: str) -> tuple[int, int]:
+    """Writes tokenizer.Phrase objects to a song file, returning the (phrase, pitch) counts
+
+    The file is written under a temporary name and renamed into place, so readers never see a partial file.
+    """
+    keys = []
+    key_codes = {None: NO_KEY}
+    starts = array("Q", [0])
+    lines = array("I")
+    codes = array("H")
+    pitches = array("B")
+    for phrase in phrases:
+        code = key_codes.get(phrase.key)
+        if code is None:
+            code = key_codes[phrase.key] = len(keys)
+            keys.append(phrase.key)
+        pitches.extend(phrase.pitches)
+        starts.append(len(pitches))
+        lines.append(phrase.line)
+        codes.append(code)
+
+    key_table = "\n".join(keys).encode("utf-8")
+    if sys.byteorder != "little":
+        for values in (starts, lines, codes):
+            values.byteswap()
+
+    temp_file_name = f"{file_name}.tmp{os.getpid()}"
+    try:
+        with open(temp_file_name, "wb") as fh:
+            offset = fh.write(HEADER.pack(MAGIC, VERSION, 0, len(lines), len(pitches), len(key_table)))
+            offset += fh.write(key_table)
+            for block in (starts, lines, codes, pitches):
+                offset += fh.write(b"\0" * padding(offset))
+                offset += fh.write(block)
+        os.replace(temp_file_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_file_name):
+            os.remove(temp_file_name)
+        raise
+    logger.debug(f"wrote {len(lines)} phrases, {len(pitches)} pitches to {file_name}")
+    return len(lines), len(pitches)
+
+
+class SongFile:
+    """Read-only memory mapped song file
+
+    phrases() yields tokenizer.Phrase objects whose pitches are memoryview slices of the mapping. Close the
+    file (or use it as a context manager) only after those phrases are no longer used.
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        with open(file_name, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{file_name} is not a song file")
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load()
+        except BaseException:
+            self.close()
+            raise
+
+    def _load(self):
+        magic, version, _, phrase_count, pitch_count, key_table_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.file_name} is not a song file")
+        if version != VERSION:
+            raise ValueError(f"{self.file_name}: unsupported song file version {version}")
+        self._view = memoryview(self._mmap)
+        self.phrase_count = phrase_count
+        self.pitch_count = pitch_count
+
+        def take(offset, count, typecode):
+            offset += padding(offset)
+            size = count * array(typecode).itemsize
+            if offset + size > len(self._view):
+                raise ValueError(f"{self.file_name}: song file is truncated")
+            block = self._view[offset:offset + size]
+            if typecode != "B" and sys.byteorder != "little":
+                values = array(typecode, block.tobytes())
+                values.byteswap()
+                return memoryview(values), offset + size
+            return block.cast(typecode), offset + size
+
+        offset = HEADER.size
+        key_table = bytes(self._view[offset:offset + key_table_size]).decode("utf-8")
+        self.keys = key_table.split("\n") if key_table else []
+        offset += key_table_size
+        self._starts, offset = take(offset, phrase_count + 1, "Q")
+        self._lines, offset = take(offset, phrase_count, "I")
+        self._codes, offset = take(offset, phrase_count, "H")
+        self.pitches, offset = take(offset, pitch_count, "B")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.phrase_count
+
+    def phrase(self, index: int) -> Phrase:
+        code = self._codes[index]
+        return Phrase(
+            None if code == NO_KEY else self.keys[code],
+            self.pitches[self._starts[index]:self._starts[index + 1]],
+            self._lines[index]
+        )
+
+    def phrases(self):
+        """Generator for yielding each Phrase (pitches are memoryview slices of the file)"""
+        for index in range(self.phrase_count):
+            yield self.phrase(index)
+
+    def close(self):
+        """Unmaps the file (left to garbage collection while pitches of yielded phrases are still referenced)"""
+        if self._mmap is None:
+            return
+        for name in ("pitches", "_starts", "_lines", "_codes", "_view"):
+            view = self.__dict__.pop(name, None)
+            if isinstance(view, memoryview):
+                try:
+                    view.release()
+                except BufferError:
+                    pass
+        try:
+            self._mmap.close()
+        except BufferError:
+            logger.debug(f"{self.file_name} is still in use: unmapped when its phrases are released")
+        self._mmap = None
+
+
+def generate_song_phrases(file_name: str):
+    """Generator for yielding each Phrase of a song file, closing the file when done"""
+    with SongFile(file_name) as song:
+        yield from song.phrases()
+
+
+def generate_notation_lines(phrases):
+    """Generator for yielding lines of notation for phrases (the inverse of tokenizer.tokenize)
+
+    Phrases from the same source line share a line, and a \\key command is written wherever the key changes.
+    Notes are spelled in the current key (with flats before any key is set).
+    """
+    table = music.get_notation_table("es")
+    key = None
+    line_number = None
+    parts = []
+    for phrase in phrases:
+        if phrase.line != line_number and parts:
+            yield " ".join(parts) + "\n"
+            parts = []
+        line_number = phrase.line
+        if phrase.key != key:
+            key = phrase.key
+            table = music.get_scale_notation_table(key)
+            parts.append(f"\\key {key} \\major")
+        parts.append(" ".join(table[pitch] for pitch in phrase.pitches))
+    if parts:
+        yield " ".join(parts) + "\n"
@@ -0,0 +1,153 @@
+"""
+tokenizer.py - Single pass tokenizer from Lilypond style text to integer pitches and key changes
+"""
+from dataclasses import dataclass, field
+import logging
+import re
+
+from harp_helper import music
+
+logger = logging.getLogger(__name__)
+
+MINOR_KEY_SIGNATURES = {
+    'a': 'c',
+    'ais': 'cis',
+    'bes': 'des',
+    'b': 'd',
+    'c': 'ees',
+    'cis': 'e',
+    'd': 'f',
+    'dis': 'fis',
+    'ees': 'ges',
+    'e': 'g',
+    'f': 'aes',
+    'fis': 'a',
+    'g': 'bes',
+    'gis': 'b'
+}
+
+TOKEN_REGEX = re.compile(
+    r"(?P<comment>#.*)"
+    r"|(?P<key>\\key(?:\s+(?P<key_name>[^\s#]+))?(?:\s+(?P<key_mode>[^\s#]+))?)(?=\s|#|$)"
+    r"|(?P<note>[^\s#]+)"
+)
+
+
+class NotationError(ValueError):
+    """Invalid token in music notation, with the (1 based) line and column where it was found"""
+
+    def __init__(self, message: str, line: int, column: int):
+        super().__init__(f"line {line}, column {column}: {message}")
+        self.line = line
+        self.column = column
+
+
+@dataclass
+class Phrase:
+    key: (None, str)
+    pitches: list[int] = field(default_factory=list)
+    line: int = 0
+
+
+def parse_key_command(key_name: str, key_scale: str) -> str:
+    """Returns the major key notation for a \\key control command (one of music.KEYS)"""
+    if key_scale not in ("\\major", "\\minor"):
+        raise ValueError(f"Unsupported mode '{key_scale}'")
+    if key_scale == "\\minor":
+        key = MINOR_KEY_SIGNATURES.get(key_name)
+        if key not in music.KEY_INDEX:
+            raise ValueError(f"Can't use minor key {key_name}")
+        return key
+    if key_name not in music.KEY_INDEX:
+        raise ValueError(f"Can't use major key {key_name}")
+    return key_name
+
+
+def invalid_notes_error(notes: list[str], line_number: int, column: int) -> NotationError:
+    """Builds the NotationError for the invalid notes of a line, at the column of the first"""
+    if len(notes) == 1:
+        return NotationError(f"Notation '{notes[0]}' is invalid", line_number, column)
+    quoted = ", ".join(f"'{note}'" for note in notes)
+    return NotationError(f"Notations {quoted} are invalid", line_number, column)
+
+
+def fast_path_error(text: str, notes: list[str], pitches: list, line_number: int) -> NotationError:
+    """Builds the NotationError for the notes (split from text) without a pitch, locating the first in text"""
+    invalid = [note for note, pitch in zip(notes, pitches) if pitch is None]
+    # Notes are split on whitespace, so the next occurrence of each one in text is the note itself
+    position = 0
+    for note, pitch in zip(notes, pitches):
+        position = text.find(note, position)
+        if pitch is None:
+            break
+        position += len(note)
+    return invalid_notes_error(invalid, line_number, position + 1)
+
+
+def tokenize(lines, key: (None, str) = None, first_line: int = 1):
+    """Generator for yielding a Phrase of pitches for each run of notes in a single key on a line
+
+    Lines may contain '#' comments and \\key <note> \\major|\\minor control commands. A key change splits a
+    line into separate phrases and carries over to following lines. Lines without control commands take a
+    split/map fast path. Invalid notes raise NotationError with the line and column of the first (and list the
+    rest of the line's), as do invalid key commands. The generator returns the key in effect after the last line
+    (see tokenize_line).
+    """
+    get_pitch = music.note_pitch
+    line_number = first_line - 1
+    for line in lines:
+        line_number += 1
+
+        # Fast path: notes only
+        if "\\" not in line:
+            text = line.partition("#")[0]
+            notes = text.split()
+            pitches = list(map(get_pitch, notes))
+            if pitches:
+                if None in pitches:
+                    raise fast_path_error(text, notes, pitches, line_number)
+                yield Phrase(key, pitches, line_number)
+            continue
+
+        phrase = Phrase(key, line=line_number)
+        matches = TOKEN_REGEX.finditer(line)
+        for match in matches:
+            kind = match.lastgroup
+            if kind == "note":
+                pitch = get_pitch(match.group())
+                if pitch is None:
+                    invalid = [match.group()] + [other.group() for other in matches
+                                                 if other.lastgroup == "note" and get_pitch(other.group()) is None]
+                    raise invalid_notes_error(invalid, line_number, match.start() + 1)
+                phrase.pitches.append(pitch)
+            elif kind == "key":
+                logger.debug("Found control event key")
+                if match.group("key_mode") is None:
+                    raise NotationError("Unable to parse \\key control command", line_number, match.start() + 1)
+                try:
+                    key = parse_key_command(match.group("key_name"), match.group("key_mode"))
+                except ValueError as e:
+                    raise NotationError(str(e), line_number, match.start() + 1) from None
+
+                # Before we change the key, yield notes from the previous key
+                if phrase.pitches:
+                    yield phrase
+                phrase = Phrase(key, line=line_number)
+            else:
+                break
+
+        # After the line yield remaining notes
+        if phrase.pitches:
+            yield phrase
+    return key
+
+
+def tokenize_line(line: str, key: (None, str) = None, line_number: int = 1) -> tuple[list[Phrase], (None, str)]:
+    """Returns the phrases of a single line and the key in effect after it (for the next line)"""
+    phrases = []
+    tokens = tokenize((line,), key, line_number)
+    while True:
+        try:
+            phrases.append(next(tokens))
+        except StopIteration as stop:
+            return phrases, stop.value
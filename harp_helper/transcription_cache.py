@@ -0,0 +1,321 @@
+"""
+transcription_cache.py - Content addressed on-disk cache of finished transcriptions
+
+An entry is the tab output of one source (a music file, song file or expression) transcribed with one set of
+options: one phrase per line, tab notes separated by spaces (the output of "harp tab"). It is stored under
+the SHA-256 of the source bytes and the options that change the output (harmonica type and key, source key,
+transpose steps, direction, best holes and the release, so an upgrade starts afresh), so an unchanged
+source is never transcribed twice, by any process.
+
+    <directory>/<first two hex digits>/<key>.tab
+
+Entries are written under a temporary name and renamed into place, so readers (in any process) see a whole
+entry or none. Reading an entry touches its modification time, and once the entries pass max_bytes the least
+recently used are removed down to LOW_WATER of it. The size is checked by scanning the directory, after this
+process has written EVICTION_SLACK of max_bytes since the last scan, so processes sharing a directory keep
+it near (not exactly at) the bound.
+"""
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from harp_helper import constants
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT = 1
+ENTRY_EXTENSION = ".tab"
+DEFAULT_MAX_BYTES = 256 << 20
+# Fraction of max_bytes left after an eviction
+LOW_WATER = 0.9
+# Fraction of max_bytes written by this process between directory scans
+EVICTION_SLACK = 0.05
+HASH_BUFFER_SIZE = 1 << 20
+# Temporary files older than this (seconds) were left by a process that died while writing
+STALE_TEMP_AGE = 3600
+# Options that change the tab output, with their defaults
+KEY_OPTIONS = (
+    ("harmonica_type", None),
+    ("harmonica_key", "c"),
+    ("source_key", None),
+    ("transpose_steps", 0),
+    ("direction", "closest"),
+    ("optimize", False)
+)
+
+
+def default_directory() -> str:
+    """The per-user cache directory ($XDG_CACHE_HOME or ~/.cache, %LOCALAPPDATA% on Windows)"""
+    base = os.getenv("XDG_CACHE_HOME") or os.getenv("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"),
+                                                                                   ".cache")
+    return os.path.join(base, constants.APP_NAME, "tabs")
+
+
+def options_hash(options: dict):
+    """Returns a sha256 object fed with the options that change the tab output (other keys are ignored)"""
+    values = [CACHE_FORMAT, constants.VERSION] + [options.get(name, default) for name, default in KEY_OPTIONS]
+    return hashlib.sha256(json.dumps(values).encode("utf-8") + b"\0")
+
+
+def text_cache_key(text: str, options: dict) -> str:
+    """Cache key of a music expression transcribed with options"""
+    digest = options_hash(options)
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def file_cache_key(file_name: str, options: dict) -> str:
+    """Cache key of a music or song file transcribed with options (the file is hashed as bytes)"""
+    digest = options_hash(options)
+    with open(file_name, "rb") as fh:
+        while True:
+            chunk = fh.read(HASH_BUFFER_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_phrase(line: str) -> list[str]:
+    """Tab notes of one line of an entry (tab notes never contain whitespace)"""
+    return line.split()
+
+
+def file_state(file_name: str) -> tuple[int, int]:
+    """(size, modification time) of a file: while it is unchanged, so is the key hashed from the file"""
+    stat = os.stat(file_name)
+    return stat.st_size, stat.st_mtime_ns
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        values = asdict(self)
+        values["hit_rate"] = round(self.hit_rate, 4)
+        return values
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses, {self.hit_rate:.0%} hit rate, {self.evictions} evicted"
+
+
+class TranscriptionCache:
+    """Size bounded, least recently used cache of tab output, safe to share between processes"""
+
+    def __init__(self, directory: (None, str) = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must not be negative, not {max_bytes}")
+        self.directory = directory if directory is not None else default_directory()
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        # Entry bytes as of the last scan plus those written since (None until the first write)
+        self._size = None
+        self._written = 0
+
+    def entry_file_name(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ENTRY_EXTENSION)
+
+    def open_entry(self, key: str):
+        """Opens the entry stored under key for reading its lines, or returns None (counted as a hit or a miss)
+
+        An open entry stays readable if another process evicts it meanwhile.
+        """
+        file_name = self.entry_file_name(key)
+        try:
+            fh = open(file_name, "r", encoding="utf-8")
+        except FileNotFoundError:
+            self.stats.misses += 1
+            return None
+        except OSError as e:
+            logger.warning(f"transcription cache: can't read {file_name}: {e}")
+            self.stats.misses += 1
+            return None
+        try:
+            os.utime(file_name)
+        except OSError:
+            # Evicted by another process since it was opened
+            pass
+        self.stats.hits += 1
+        return fh
+
+    def get(self, key: str) -> (None, str):
+        """Returns the entry text stored under key, or None (counted as a hit or a miss)"""
+        fh = self.open_entry(key)
+        if fh is None:
+            return None
+        with fh:
+            return fh.read()
+
+    def writer(self, key: str) -> "EntryWriter":
+        """Returns an EntryWriter storing phrases under key as they are written"""
+        return EntryWriter(self, key)
+
+    def put(self, key: str, text: str) -> bool:
+        """Stores text under key (replacing any entry), returning False if it could not be written"""
+        with self.writer(key) as writer:
+            writer.write(text)
+            return writer.commit()
+
+    def added(self, size: int):
+        """Accounts for an entry of size bytes stored by this process, evicting when the cache may be full"""
+        self.stats.writes += 1
+        self._written += size
+        if self._size is None or self._size + self._written > self.max_bytes or \
+                self._written > self.max_bytes * EVICTION_SLACK:
+            self.evict()
+
+    def scan(self) -> list[tuple[float, int, str]]:
+        """Returns (last used, size, file name) of every entry, removing stale temporary files"""
+        entries = []
+        now = time.time()
+        try:
+            subdirectories = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        except FileNotFoundError:
+            return entries
+        for subdirectory in subdirectories:
+            try:
+                with os.scandir(subdirectory) as scanner:
+                    for entry in scanner:
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        if entry.name.endswith(ENTRY_EXTENSION):
+                            entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        elif now - stat.st_mtime > STALE_TEMP_AGE:
+                            self.remove(entry.path)
+            except FileNotFoundError:
+                continue
+        return entries
+
+    @staticmethod
+    def remove(file_name: str) -> bool:
+        try:
+            os.remove(file_name)
+        except FileNotFoundError:
+            # Removed by another process
+            return False
+        except OSError as e:
+            logger.warning(f"transcription cache: can't remove {file_name}: {e}")
+            return False
+        return True
+
+    def evict(self):
+        """Removes the least recently used entries while the cache is over max_bytes (down to LOW_WATER)"""
+        entries = self.scan()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        if size > self.max_bytes:
+            target = self.max_bytes * LOW_WATER
+            entries.sort()
+            for _, entry_size, file_name in entries:
+                if size <= target:
+                    break
+                if self.remove(file_name):
+                    self.stats.evictions += 1
+                size -= entry_size
+            logger.debug(f"transcription cache: evicted down to {size} bytes")
+        self._size = size
+        self._written = 0
+
+    def clear(self):
+        """Removes every entry"""
+        for _, _, file_name in self.scan():
+            self.remove(file_name)
+        self._size = 0
+        self._written = 0
+
+
+class EntryWriter:
+    """Streams an entry to a temporary file, stored under its key by commit() (discarded otherwise)
+
+        with cache.writer(key) as writer:
+            for tabs in writer.tee(phrases):
+                ...
+            writer.commit()
+
+    Only the phrase being written is held in memory. An entry larger than max_bytes is not stored.
+    """
+
+    def __init__(self, cache: TranscriptionCache, key: str):
+        self.cache = cache
+        self.file_name = cache.entry_file_name(key)
+        self.temp_file_name = f"{self.file_name}.tmp{os.getpid()}.{threading.get_ident()}"
+        self._fh = None
+        try:
+            os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+            self._fh = open(self.temp_file_name, "w", encoding="utf-8", newline="\n")
+        except OSError as e:
+            logger.warning(f"transcription cache: can't write {self.file_name}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.discard()
+
+    def write(self, text: str):
+        if self._fh is None:
+            return
+        try:
+            self._fh.write(text)
+        except OSError as e:
+            logger.warning(f"transcription cache: can't write {self.file_name}: {e}")
+            self.discard()
+
+    def write_phrase(self, tabs: list[str]):
+        self.write(" ".join(tabs) + "\n")
+
+    def tee(self, phrases):
+        """Generator for yielding each phrase (list of tab notes) of phrases after writing it to the entry"""
+        for tabs in phrases:
+            self.write_phrase(tabs)
+            yield tabs
+
+    def commit(self) -> bool:
+        """Stores the entry written so far, returning False if it could not be (or is too large to be) stored"""
+        if self._fh is None:
+            return False
+        try:
+            self._fh.close()
+            self._fh = None
+            size = os.path.getsize(self.temp_file_name)
+            if size > self.cache.max_bytes:
+                logger.debug(f"transcription cache: {size} byte entry is larger than the cache")
+                self.discard()
+                return False
+            os.replace(self.temp_file_name, self.file_name)
+        except OSError as e:
+            logger.warning(f"transcription cache: can't write {self.file_name}: {e}")
+            self.discard()
+            return False
+        self.temp_file_name = None
+        self.cache.added(size)
+        return True
+
+    def discard(self):
+        """Removes the temporary file unless the entry was committed"""
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+            self._fh = None
+        if self.temp_file_name is not None:
+            try:
+                os.remove(self.temp_file_name)
+            except OSError:
+                pass
+            self.temp_file_name = None
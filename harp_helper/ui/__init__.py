@@ -0,0 +1,24 @@
+"""
+ui - Qt Designer files; <name>_ui.py modules are generated from <name>.ui when the package is built
+"""
+import os
+
+UI_DIR = os.path.dirname(__file__)
+
+
+def compile_ui_files(ui_dir: str = UI_DIR) -> list[str]:
+    """Compiles every <name>.ui in ui_dir to <name>_ui.py, returning the modules written"""
+    from PyQt6 import uic
+
+    written = []
+    for file_name in sorted(os.listdir(ui_dir)):
+        if not file_name.endswith(".ui"):
+            continue
+        ui_file = os.path.join(ui_dir, file_name)
+        py_file = os.path.join(ui_dir, file_name[:-len(".ui")] + "_ui.py")
+        if os.path.exists(py_file) and os.path.getmtime(py_file) >= os.path.getmtime(ui_file):
+            continue
+        with open(py_file, "w") as fh:
+            uic.compileUi(ui_file, fh)
+        written.append(py_file)
+    return written
@@ -0,0 +1,91 @@
+"""
+workers.py - Background jobs for the GUI (transcription and chart generation off the Qt main thread)
+"""
+import logging
+import time
+import traceback
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+logger = logging.getLogger(__name__)
+
+# Results are delivered to the GUI at most this often (seconds) or when a batch is full
+BATCH_INTERVAL = 1 / 30
+BATCH_SIZE = 500
+
+
+class WorkerSignals(QObject):
+    batch = pyqtSignal(list)
+    progress = pyqtSignal(int)
+    error = pyqtSignal(str)
+    finished = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Runs process(source) on a QThreadPool thread and emits its output in batches
+
+    source is any iterable; measure(item) gives the amount of progress each item represents and total the
+    sum of those amounts (0 if unknown). Every item of source must be read through the iterable passed to
+    process so that progress and cancellation are tracked.
+    """
+
+    def __init__(self, source, process, total: int = 0, measure=None,
+                 batch_size: int = BATCH_SIZE, batch_interval: float = BATCH_INTERVAL):
+        super().__init__()
+        # The GUI keeps the Python object alive until finished is delivered, so Qt must not delete it
+        self.setAutoDelete(False)
+        self.signals = WorkerSignals()
+        self.source = source
+        self.process = process
+        self.total = total
+        self.measure = measure if measure is not None else (lambda item: 1)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.position = 0
+        self.failed = False
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+
+    @property
+    def percent(self) -> int:
+        if self.total <= 0:
+            return 0
+        return min(100, self.position * 100 // self.total)
+
+    def track(self):
+        """Generator for yielding source items while recording progress (stops when cancelled)"""
+        for item in self.source:
+            if self._cancelled:
+                return
+            self.position += self.measure(item)
+            yield item
+
+    def run(self):
+        batch = []
+        last_emit = time.monotonic()
+        try:
+            for output in self.process(self.track()):
+                if self._cancelled:
+                    break
+                batch.append(output)
+                now = time.monotonic()
+                if len(batch) >= self.batch_size or now - last_emit >= self.batch_interval:
+                    self.signals.batch.emit(batch)
+                    self.signals.progress.emit(self.percent)
+                    batch = []
+                    last_emit = now
+            if batch and not self._cancelled:
+                self.signals.batch.emit(batch)
+        except Exception:
+            self.failed = True
+            if not self._cancelled:
+                self.signals.error.emit(traceback.format_exc())
+        finally:
+            logger.debug(f"worker finished (cancelled={self._cancelled})")
+            self.signals.finished.emit()
@@ -0,0 +1,178 @@
+"""
+writers.py - Streaming table writers (pretty table, CSV, JSON Lines and HTML)
+
+A writer sends rows straight to a sink (any object with write(): a file, sys.stdout, io.StringIO), so output
+never has to be built as one string. Only the table writer holds rows back, and only those of the current
+table, since its column widths depend on every cell.
+
+    with get_writer("csv", sink) as writer:
+        writer.write_table(headers, rows, title="...")
+"""
+import csv
+import html
+import json
+import os
+
+# File name extension -> output format, for saving by file name
+FILE_EXTENSIONS = {
+    ".txt": "table",
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".html": "html",
+    ".htm": "html"
+}
+
+
+class Writer:
+    """Base class of the streaming writers, registered by output_format as they are defined"""
+
+    output_format = None
+
+    # output_format -> Writer subclass
+    _registry = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.output_format is not None:
+            cls._registry[cls.output_format] = cls
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.tables = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def begin_table(self, headers: (list, tuple), title: (None, str) = None):
+        self.tables += 1
+
+    def write_row(self, row: (list, tuple)):
+        raise NotImplementedError
+
+    def end_table(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write_table(self, headers: (list, tuple), rows, title: (None, str) = None):
+        """Writes a table, consuming rows (any iterable of rows) one at a time"""
+        self.begin_table(headers, title)
+        for row in rows:
+            self.write_row(row)
+        self.end_table()
+
+
+class TableWriter(Writer):
+    """Plain text table with centered columns (the layout of tabulate's "pretty" format)"""
+
+    output_format = "table"
+
+    def begin_table(self, headers: (list, tuple), title: (None, str) = None):
+        if self.tables:
+            self.sink.write("\n")
+        super().begin_table(headers, title)
+        if title is not None:
+            self.sink.write(f"{title}\n")
+        self.headers = [str(header) for header in headers]
+        self.rows = []
+
+    def write_row(self, row: (list, tuple)):
+        self.rows.append([str(cell) for cell in row])
+
+    def end_table(self):
+        columns = max([len(self.headers)] + [len(row) for row in self.rows])
+        widths = [0] * columns
+        for row in [self.headers] + self.rows:
+            for column, cell in enumerate(row):
+                widths[column] = max(widths[column], len(cell))
+        rule = "+" + "+".join("-" * (width + 2) for width in widths) + "+\n"
+
+        def write_cells(cells):
+            cells = cells + [""] * (columns - len(cells))
+            self.sink.write("| " + " | ".join(f"{cell:^{width}}" for cell, width in zip(cells, widths)) + " |\n")
+
+        self.sink.write(rule)
+        if self.headers:
+            write_cells(self.headers)
+            self.sink.write(rule)
+        for row in self.rows:
+            write_cells(row)
+        self.sink.write(rule)
+        self.rows = []
+
+
+class CsvWriter(Writer):
+    """CSV written with the csv module (fields are quoted when needed); a title is a row of its own"""
+
+    output_format = "csv"
+
+    def __init__(self, sink):
+        super().__init__(sink)
+        self.writer = csv.writer(sink, lineterminator="\n")
+
+    def begin_table(self, headers: (list, tuple), title: (None, str) = None):
+        if self.tables:
+            self.sink.write("\n")
+        super().begin_table(headers, title)
+        if title is not None:
+            self.writer.writerow([title])
+        self.writer.writerow(headers)
+
+    def write_row(self, row: (list, tuple)):
+        self.writer.writerow(row)
+
+
+class JsonLinesWriter(Writer):
+    """One JSON object per line: {"title", "headers"} when a table begins, then {"title", "cells"} per row"""
+
+    output_format = "jsonl"
+
+    def begin_table(self, headers: (list, tuple), title: (None, str) = None):
+        super().begin_table(headers, title)
+        self.title = title
+        self.sink.write(json.dumps({"title": title, "headers": list(headers)}))
+        self.sink.write("\n")
+
+    def write_row(self, row: (list, tuple)):
+        self.sink.write(json.dumps({"title": self.title, "cells": list(row)}))
+        self.sink.write("\n")
+
+
+class HtmlWriter(Writer):
+    """HTML table elements (a fragment, ready for a QTextBrowser or a page body)"""
+
+    output_format = "html"
+
+    def begin_table(self, headers: (list, tuple), title: (None, str) = None):
+        super().begin_table(headers, title)
+        self.sink.write("<table border=\"1\" cellpadding=\"3\">\n")
+        if title is not None:
+            self.sink.write(f"<caption>{html.escape(title)}</caption>\n")
+        self.sink.write("<tr>" + "".join(f"<th>{html.escape(str(header))}</th>" for header in headers) + "</tr>\n")
+
+    def write_row(self, row: (list, tuple)):
+        self.sink.write("<tr>" + "".join(f"<td>{html.escape(str(cell))}</td>" for cell in row) + "</tr>\n")
+
+    def end_table(self):
+        self.sink.write("</table>\n")
+
+
+def output_formats() -> tuple[str]:
+    return tuple(Writer._registry)
+
+
+def get_writer(output_format: str, sink) -> Writer:
+    """Returns the writer for output_format writing to sink"""
+    writer_class = Writer._registry.get(output_format)
+    if writer_class is None:
+        raise ValueError(f"Unknown output format {output_format}")
+    return writer_class(sink)
+
+
+def file_output_format(file_name: str, default: str) -> str:
+    """Returns the output format matching the extension of file_name, or default"""
+    return FILE_EXTENSIONS.get(os.path.splitext(file_name)[1].lower(), default)
@@ -1,13 +1,29 @@
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py
 from harp_helper import constants
 
 with open('requirements.txt', 'r') as fh:
     requirements = fh.read().split("\n")
 
+
+class BuildPyCommand(build_py):
+    """Precompiles the Qt Designer .ui files to Python modules before building"""
+
+    def run(self):
+        try:
+            from harp_helper.ui import compile_ui_files
+            for py_file in compile_ui_files():
+                print(f"compiled {py_file}")
+        except ImportError:
+            print("PyQt6 not available: .ui files will be loaded at runtime")
+        super().run()
+
+
 setup(
     name=constants.APP_NAME,
     version=constants.VERSION,
     packages=find_packages(include=['harp_helper', 'harp_helper.*']),
+    package_data={'harp_helper.ui': ['*.ui']},
     python_requires='>=3.5',
     url='',
     license='',
@@ -15,7 +31,13 @@ setup(
     author_email='tim.martin.nowhere.test',
     description='Graphical Python script for Harmonica',
     install_requires=requirements,
+    extras_require={
+        'fast': ['numpy']
+    },
+    cmdclass={
+        'build_py': BuildPyCommand
+    },
     entry_points={
-        'console_scripts': ['harp=harp_helper.main:main']
+        'console_scripts': ['harp=harp_helper.cli:main']
     }
 )